@@ -0,0 +1,450 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import requests
+
+from cascade import add_cascade_args, describe_tier, policy_from_args, review_with_cascade
+from code_index import add_index_args, index_from_args, unit_contexts
+from code_review import (add_client_args, add_prompt_args, build_messages, check_prompt_args, chunk_instruction,
+                         client_from_args, compaction_from_args, endpoint_urls, response_format)
+from deadline import DeadlineScheduler, RateProfile, duration_arg
+from findings_store import add_store_args, record_batch, store_from_args
+from incremental import carry_forward, plan_incremental, previous_manifest, unit_sha
+from job_journal import JobJournal, resume_plan
+from near_duplicates import DEFAULT_THRESHOLD, group_near_duplicates, member_findings
+from ollama_client import DEFAULT_URL, OllamaError, make_session
+from review_client import DEFAULT_MODEL
+from scheduler import EndpointsUnavailable
+from sql_chunker import chunk_line_numbers, split_ctes
+from sql_lint import findings_between, lint_markdown, lint_sql
+from structured_findings import FINDINGS_SCHEMA, findings_markdown, parse_structured, severity_counts
+
+DEFAULT_OUTPUT_DIR = ".code-review"
+DEFAULT_EXTENSIONS = (".sql", ".py", ".js", ".ts", ".java", ".cs", ".go", ".rb", ".scala", ".kt", ".sh")
+SKIPPED_DIRECTORIES = {".git", ".code-review", ".venv", "venv", "node_modules", "__pycache__", ".tox", ".mypy_cache"}
+DEFAULT_BACKOFF = 30
+
+
+@dataclass
+class ReviewUnit:
+    id: str
+    path: str
+    name: str
+    text: str
+    start_line: int
+    end_line: int
+    depends_on: list = field(default_factory=list)
+    lint: list = None
+    preamble_line: int = None
+
+
+def git(target, *args):
+    result = subprocess.run(["git", *args], cwd=target, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def batch_name(target):
+    """Name a batch from git state: tag, then branch-hash, then date-hash (date only outside git)."""
+    today = datetime.date.today().isoformat()
+    commit = git(target, "rev-parse", "--short", "HEAD")
+    if not commit:
+        return today
+    tag = git(target, "describe", "--tags", "--exact-match")
+    if tag:
+        return tag
+    branch = git(target, "rev-parse", "--abbrev-ref", "HEAD")
+    if branch and branch != "HEAD":
+        return f"{branch.replace('/', '-')}-{commit}"
+    return f"{today}-{commit}"
+
+
+def collect_units(target, extensions=DEFAULT_EXTENSIONS, lint=False):
+    """Walk target and turn every reviewable file into units: one per CTE for SQL, one per file otherwise.
+
+    With lint, each SQL file is linted once and every unit keeps the findings inside its line range.
+    """
+    paths = [target] if os.path.isfile(target) else sorted(_walk(target, extensions))
+    root = os.path.dirname(target) if os.path.isfile(target) else target
+    units = []
+    for path in paths:
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        with open(path, encoding="utf-8", errors="replace") as file:
+            text = file.read()
+        if not text.strip():
+            continue
+        is_sql = path.lower().endswith(".sql")
+        chunks = split_ctes(text) if is_sql else []
+        findings = lint_sql(text) if is_sql and lint else None
+        if len(chunks) > 1:
+            units.extend(
+                ReviewUnit(f"{relative}#{chunk.name}", relative, chunk.name, chunk.text,
+                           chunk.start_line, chunk.end_line, chunk.depends_on,
+                           None if findings is None else findings_between(findings, chunk.start_line, chunk.end_line),
+                           chunk.preamble_line)
+                for chunk in chunks
+            )
+        else:
+            units.append(ReviewUnit(relative, relative, "", text, 1, text.count("\n") + 1, lint=findings))
+    return units
+
+
+def _walk(target, extensions):
+    for directory, subdirectories, files in os.walk(target):
+        subdirectories[:] = sorted(d for d in subdirectories if d not in SKIPPED_DIRECTORIES)
+        for name in files:
+            if name.lower().endswith(tuple(extensions)):
+                yield os.path.join(directory, name)
+
+
+def unit_filename(unit):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", unit.id) + ".md"
+
+
+def run_batch(units, output_dir, client, concurrency=4, policy=None, compaction=None, duplicates=None, journal=None,
+              attempts=1, backoff=DEFAULT_BACKOFF, structured=False, scheduler=None, contexts=None):
+    """Review units concurrently; units in duplicates ({id: (representative id, similarity)}) reuse that review.
+
+    Every state change goes to the journal (progress.jsonl). A request that times out, loses its connection or
+    finds no endpoint of a pool available is tried up to attempts times, waiting backoff seconds before the
+    second try and doubling after that. With structured, each reply's JSON findings are validated into the
+    unit's result and its report is rendered from them. With a scheduler (deadline.DeadlineScheduler) it decides
+    the order units are reviewed in and may downgrade their model or num_predict to meet its deadline. contexts
+    ({id: related definitions block}, from code_index.unit_contexts) is sent ahead of each unit's code.
+    """
+    os.makedirs(os.path.join(output_dir, "units"), exist_ok=True)
+    journal = journal or JobJournal(os.path.join(output_dir, "progress.jsonl"))
+    duplicates = duplicates or {}
+    contexts = contexts or {}
+    results = {}
+    answers = {}
+    started = time.monotonic()
+
+    def finish(unit, result):
+        results[unit.id] = result
+        journal.record(unit.id, {**result, "sha": unit_sha(unit)})
+        model = f' [{result["model"]}]' if "model" in result else ""
+        print(f'[{len(results)}/{len(units)}] {result["status"]:<5} {unit.id}{model} ({result["elapsed"]:.1f}s)')
+
+    def unit_messages(unit):
+        # Only SQL is compacted; elsewhere indentation can carry meaning.
+        unit_compaction = compaction if unit.path.lower().endswith(".sql") else None
+        return build_messages(chunk_instruction(unit, unit.path), unit.text, unit.lint, unit_compaction,
+                              chunk_line_numbers(unit), structured, contexts.get(unit.id))
+
+    def review(unit, submitted, assignment=None):
+        unit_started = time.monotonic()
+        messages = prompts[unit.id]
+        downgraded = assignment is not None and assignment.downgrades
+        options = {"num_predict": assignment.num_predict} if downgraded and assignment.num_predict else None
+        # A cheaper model is used on its own; a cap alone still goes through every cascade tier.
+        swapped = downgraded and assignment.model != scheduler.model
+        for attempt in range(1, attempts + 1):
+            journal.record(unit.id, {"status": "in_flight", "attempt": attempt})
+            queue_wait = round((unit_started - submitted) * 1e9) if attempt == 1 else 0
+            try:
+                if swapped:
+                    data = client.send(messages, model=assignment.model, chunk_id=unit.id, queue_wait=queue_wait,
+                                       options=options)
+                else:
+                    data = review_with_cascade(client, messages, policy, chunk_id=unit.id, queue_wait=queue_wait,
+                                               options=options)
+                break
+            except (requests.Timeout, requests.ConnectionError, EndpointsUnavailable) as error:
+                if attempt == attempts:
+                    return {"status": "error", "error": str(error), "attempts": attempt,
+                            "elapsed": time.monotonic() - unit_started}
+                time.sleep(backoff * 2 ** (attempt - 1))
+            except (requests.RequestException, OllamaError) as error:
+                return {"status": "error", "error": str(error), "attempts": attempt,
+                        "elapsed": time.monotonic() - unit_started}
+        if scheduler:
+            scheduler.done(unit, data.get("endpoint", client.url), data["model"], data)
+        extra = {"downgraded": assignment.downgrades} if downgraded else {}
+        answer = data["message"]["content"]
+        if structured:
+            findings, problems = parse_structured(answer, FINDINGS_SCHEMA)
+            answer = findings_markdown(findings)
+            if problems:
+                answer += "\n_Dropped invalid findings:_\n\n" + "".join(f"- {problem}\n" for problem in problems)
+            extra.update(findings=findings, invalid_findings=len(problems))
+        answers[unit.id] = f"_{describe_tier(data)}_\n\n", answer
+        result_file = write_unit_report(output_dir, unit, *answers[unit.id])
+        return {
+            "status": "done",
+            "result_file": result_file,
+            "model": data["model"],
+            "tier": data.get("tier", 0),
+            "cascade": data.get("cascade", []),
+            "elapsed": time.monotonic() - unit_started,
+            "total_duration": data["total_duration"],
+            "prompt_eval_count": data["prompt_eval_count"],
+            "eval_count": data["eval_count"],
+            "reasoning_tokens": data.get("reasoning_tokens"),
+            "answer_tokens": data.get("answer_tokens"),
+            "stopped": data.get("stopped"),
+            "cache_hit": data["cache_hit"],
+            "load_duration_saved": data.get("load_duration_saved", 0),
+            "prompt_eval_saved": data.get("prompt_eval_saved", 0),
+            "lint_findings": len(unit.lint or []),
+            "attempts": attempt,
+            **extra,
+        }
+
+    def work(take, submitted):
+        unit, assignment = take()
+        try:
+            return unit, review(unit, submitted, assignment)
+        finally:
+            if scheduler:
+                scheduler.done(unit)
+
+    for unit in units:
+        journal.record(unit.id, {"status": "pending"})
+    queued = [unit for unit in units if unit.id not in duplicates]
+    prompts = {unit.id: unit_messages(unit) for unit in queued}
+    if scheduler:
+        scheduler.queue(queued, prompts)
+        print(f"predicted to finish in {scheduler.predicted_finish():.0f}s of the {scheduler.deadline:.0f}s deadline "
+              "before any downgrades")
+        jobs = [scheduler.take for _ in queued]
+    else:
+        jobs = [lambda unit=unit: (unit, None) for unit in queued]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(work, take, time.monotonic()) for take in jobs]
+        for future in as_completed(futures):
+            finish(*future.result())
+
+    units_by_id = {unit.id: unit for unit in units}
+    for unit in units:
+        if unit.id not in duplicates:
+            continue
+        representative, similarity = duplicates[unit.id]
+        if results[representative]["status"] != "done":
+            finish(unit, {"status": "error", "error": f"near-duplicate of {representative}, which failed",
+                          "duplicate_of": representative, "elapsed": 0.0})
+            continue
+        heading, answer = answers[representative]
+        extra = {}
+        if structured:
+            findings = member_findings(results[representative]["findings"], units_by_id[representative], unit)
+            answer = findings_markdown(findings)
+            extra["findings"] = findings
+            note = (f"_Near-duplicate of `{representative}` (similarity {similarity:.2f}), so it was reviewed once "
+                    f"with that unit; its findings are shown with their lines moved to this unit._\n\n")
+        else:
+            note = (f"_Near-duplicate of `{representative}` (similarity {similarity:.2f}), so it was reviewed once "
+                    f"with that unit; line numbers below refer to `{representative}`._\n\n")
+        finish(unit, {
+            **results[representative],
+            "result_file": write_unit_report(output_dir, unit, heading + note, answer),
+            "elapsed": 0.0,
+            "total_duration": 0,
+            "prompt_eval_count": 0,
+            "eval_count": 0,
+            "reasoning_tokens": 0,
+            "answer_tokens": 0,
+            "load_duration_saved": 0,
+            "prompt_eval_saved": 0,
+            "lint_findings": len(unit.lint or []),
+            "duplicate_of": representative,
+            "similarity": similarity,
+            **extra,
+        })
+
+    load_saved = sum(result.get("load_duration_saved", 0) for result in results.values())
+    prompt_saved = sum(result.get("prompt_eval_saved", 0) for result in results.values())
+    print(f"reviewed {len(units)} units in {time.monotonic() - started:.1f}s "
+          f"(saved {load_saved / 1e9:.1f}s of model loading and {prompt_saved / 1e9:.1f}s of prompt evaluation)")
+    if compaction and compaction.original_tokens:
+        print(compaction.summary())
+    if scheduler:
+        for rates in scheduler.profile.snapshot():
+            print(f'measured {rates["model"]} on {rates["endpoint"]}: {rates["eval_rate"]} tokens/s, '
+                  f'prompt {rates["prompt_rate"]} tokens/s, ~{rates["reply_tokens"]} reply tokens')
+    if scheduler and scheduler.downgraded:
+        print(f"downgraded {len(scheduler.downgraded)} units to meet the {scheduler.deadline:.0f}s deadline:")
+        for unit_id, downgrades in scheduler.downgraded.items():
+            print(f"  {unit_id}: {', '.join(downgrades)}")
+    if structured:
+        counts = severity_counts([finding for result in results.values() for finding in result.get("findings", [])])
+        print("findings: " + ", ".join(f"{count} {severity}" for severity, count in counts.items()))
+    return results
+
+
+def write_unit_report(output_dir, unit, heading, answer):
+    result_file = os.path.join("units", unit_filename(unit))
+    with open(os.path.join(output_dir, result_file), "w", encoding="utf-8") as file:
+        file.write(f"# {unit.id}\n\n{heading}")
+        if unit.lint is not None:
+            file.write(lint_markdown(unit.lint) + "\n")
+        file.write(f"{answer}\n")
+    return result_file
+
+
+def write_manifest(output_dir, name, target, model, units, results, started_at, base_batch=None):
+    manifest = {
+        "name": name,
+        "target": target,
+        "commit": git(repository_dir(target), "rev-parse", "HEAD"),
+        "base_batch": base_batch,
+        "model": model,
+        "started_at": started_at,
+        "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "units": [
+            {
+                "id": unit.id,
+                "path": unit.path,
+                "name": unit.name,
+                "start_line": unit.start_line,
+                "end_line": unit.end_line,
+                "sha": unit_sha(unit),
+                **results.get(unit.id, {"status": "pending"}),
+            }
+            for unit in units
+        ],
+    }
+    with open(os.path.join(output_dir, "batch.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def repository_dir(target):
+    return target if os.path.isdir(target) else os.path.dirname(target)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Review every file under a path with a local Ollama model.")
+    parser.add_argument("path", help="file or directory to review")
+    parser.add_argument("--name", help="batch name (defaults to git tag, branch-hash or date-hash)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="batches are written to <output-dir>/<name>/")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help="Ollama /api/chat endpoint; separate several with commas to spread requests over them")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Ollama model tag")
+    parser.add_argument("--extensions", default=",".join(DEFAULT_EXTENSIONS), help="comma separated file extensions")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=3600, help="deadline in seconds for each reply")
+    parser.add_argument("--retries", type=int, default=3, help="retries for refused connections and 5xx responses")
+    parser.add_argument("--attempts", type=int, default=3, help="tries per unit when a reply misses its deadline")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF,
+                        help="seconds before the second try of a unit, doubling for each try after that")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard progress of an interrupted batch with the same name instead of resuming it")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-review units changed since the last batch, carrying earlier findings forward")
+    parser.add_argument("--since-batch", help="with --incremental, diff against this batch instead of the latest")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="review units this similar (0-1, shingle Jaccard) once per group")
+    parser.add_argument("--no-dedupe", action="store_true", help="review near-duplicate units separately")
+    parser.add_argument("--deadline", type=duration_arg,
+                        help="finish the batch within this long (seconds, or e.g. 45m, 2h), downgrading units if needed")
+    parser.add_argument("--fallback-models",
+                        help="comma separated cheaper models to downgrade to for --deadline, preferred first "
+                             "(defaults to the lower --cascade tiers)")
+    add_prompt_args(parser)
+    add_client_args(parser)
+    add_cascade_args(parser)
+    add_store_args(parser)
+    add_index_args(parser)
+    parser.set_defaults(keep_alive="30m")
+    return check_prompt_args(parser, parser.parse_args(argv))
+
+
+def deadline_scheduler(args, client, policy):
+    """A DeadlineScheduler for --deadline, its rates seeded from earlier runs' telemetry.
+
+    A cascade is priced at its most capable tier (any unit may escalate that far). A num_predict cap still runs
+    the whole cascade under that cap; moving to a cheaper model runs that one tier without escalation.
+    """
+    profile = RateProfile.from_telemetry(None if args.no_telemetry else args.telemetry_log)
+    if client.pool:
+        client.pool.profile = profile
+    model = policy.tiers[-1] if policy else args.model
+    if args.fallback_models:
+        fallbacks = [name.strip() for name in args.fallback_models.split(",") if name.strip()]
+    else:
+        fallbacks = policy.tiers[-2::-1] if policy else []
+    return DeadlineScheduler(profile, args.deadline, args.concurrency, model, fallbacks)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    target = os.path.abspath(args.path)
+    name = args.name or batch_name(repository_dir(target))
+    output_dir = os.path.join(args.output_dir, name)
+    extensions = tuple(ext.strip() for ext in args.extensions.split(",") if ext.strip())
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    units = collect_units(target, extensions, lint=not args.no_lint)
+    if not units:
+        print(f"nothing to review under {args.path}", file=sys.stderr)
+        return 1
+
+    to_review, carried, previous = units, {}, None
+    if args.incremental or args.since_batch:
+        previous = previous_manifest(args.output_dir, name=args.since_batch)
+        if previous:
+            to_review, carried = plan_incremental(units, repository_dir(target), previous)
+            carry_forward(carried, previous, output_dir)
+            print(f"incremental against {previous['name']} ({previous['commit'][:7]}): "
+                  f"{len(to_review)} changed, {len(carried)} carried forward")
+        else:
+            print("no earlier batch with a commit found; reviewing everything")
+    journal = JobJournal(os.path.join(output_dir, "progress.jsonl"))
+    finished = {}
+    if args.restart:
+        journal.reset()
+    else:
+        to_review, finished = resume_plan(to_review, journal, output_dir)
+        if finished:
+            print(f"resuming {name}: {len(finished)} units already done, {len(to_review)} left")
+    duplicates = {} if args.no_dedupe else group_near_duplicates(to_review, args.dedupe_threshold)
+    print(f"batch {name}: {len(to_review)} units ({len(duplicates)} near-duplicates reuse another review) "
+          f"-> {output_dir}")
+
+    session = make_session(args.concurrency, args.retries, hosts=len(endpoint_urls(args.url)))
+    client = client_from_args(args, session=session, timeout=args.timeout, format=response_format(args))
+    policy = policy_from_args(args)
+    scheduler = deadline_scheduler(args, client, policy) if args.deadline else None
+    index = index_from_args(args, session=session)
+    contexts = {}
+    if index:
+        # Every unit is indexed, so units re-reviewed incrementally still see the definitions left unchanged.
+        index.add_units(units)
+        contexts = unit_contexts(index, [unit for unit in to_review if unit.id not in duplicates])
+        embedded = f", {index.embeddings.embedded} newly embedded" if index.embeddings else ""
+        print(f"index: {len(index.definitions)} definitions{embedded}; related definitions for "
+              f"{len(contexts)} of {len(to_review)} units")
+    try:
+        results = run_batch(to_review, output_dir, client, concurrency=args.concurrency, policy=policy,
+                            compaction=compaction_from_args(args), duplicates=duplicates, journal=journal,
+                            attempts=args.attempts, backoff=args.backoff, structured=args.structured,
+                            scheduler=scheduler, contexts=contexts)
+    finally:
+        session.close()
+        client.telemetry.close()
+    manifest = write_manifest(output_dir, name, target, args.model, units, {**carried, **finished, **results},
+                              started_at, base_batch=previous["name"] if previous else None)
+    store = store_from_args(args) if args.structured else None
+    if store:
+        recorded = record_batch(store, manifest)
+        store.close()
+        print(f"recorded {recorded} findings for {name} in {store.path}")
+    stats = client.cache.stats()
+    print(f'cache: {stats["hits"]} hits, {stats["misses"]} misses, {stats["evictions"]} evictions')
+    if client.pool:
+        for endpoint in client.pool.stats():
+            state = "up" if endpoint["healthy"] else "down"
+            print(f'endpoint {endpoint["url"]}: {state}, {endpoint["served"]} served, {endpoint["failures"]} failures')
+    return 0 if all(result["status"] == "done" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+import requests
+
+from batch_review import collect_units
+from code_review import build_messages, chunk_instruction, get_code_for_review
+from ollama_client import OllamaError, percentile
+from ollama_stub import StubOllama
+from review_client import ReviewClient
+from sql_chunker import split_ctes
+
+DEFAULT_OUTPUT_DIR = ".code-review/benchmarks"
+DOCKERFILE_PATTERN = os.path.join(os.path.dirname(__file__), "..", ".devcontainer", "deepseek-r1.*.dockerfile")
+
+
+def devcontainer_models(pattern=DOCKERFILE_PATTERN):
+    """The model tags pulled by the .devcontainer Dockerfiles, smallest first."""
+    models = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as file:
+            for model in re.findall(r"^RUN .*ollama pull (\S+)", file.read(), re.MULTILINE):
+                if model not in models:
+                    models.append(model)
+    return models
+
+
+def benchmark_corpus(path=None):
+    """Fixed review inputs: the units under path, or the sample SQL split into CTEs."""
+    if path:
+        units = collect_units(os.path.abspath(path))
+        return [(unit.id, build_messages(chunk_instruction(unit, unit.path), unit.text)) for unit in units]
+    return [(chunk.name, build_messages(chunk_instruction(chunk), chunk.text))
+            for chunk in split_ctes(get_code_for_review())]
+
+
+def corpus_digest(corpus):
+    return hashlib.sha256(json.dumps(corpus, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def run_model(client, model, corpus, repeat=1, stream=False):
+    samples = []
+    on_token = (lambda token: None) if stream else None
+    for iteration in range(repeat):
+        for name, messages in corpus:
+            started = time.perf_counter_ns()
+            try:
+                data = client.send(messages, on_token=on_token, model=model)
+            except (requests.RequestException, OllamaError) as error:
+                samples.append({"model": model, "unit": name, "iteration": iteration, "error": str(error)})
+                continue
+            samples.append({
+                "model": model,
+                "unit": name,
+                "iteration": iteration,
+                "latency": time.perf_counter_ns() - started,
+                "time_to_first_token": data.get("time_to_first_token"),
+                "load_duration": data.get("load_duration", 0),
+                "prompt_eval_count": data.get("prompt_eval_count", 0),
+                "prompt_eval_duration": data.get("prompt_eval_duration", 0),
+                "eval_count": data.get("eval_count", 0),
+                "eval_duration": data.get("eval_duration", 0),
+            })
+    return samples
+
+
+def summarise(samples):
+    ok = [sample for sample in samples if "error" not in sample]
+    latencies = sorted(sample["latency"] for sample in ok)
+    first_tokens = sorted(sample["time_to_first_token"] for sample in ok if sample["time_to_first_token"] is not None)
+    eval_count = sum(sample["eval_count"] for sample in ok)
+    eval_duration = sum(sample["eval_duration"] for sample in ok)
+    prompt_count = sum(sample["prompt_eval_count"] for sample in ok)
+    prompt_duration = sum(sample["prompt_eval_duration"] for sample in ok)
+    loads = [sample["load_duration"] for sample in ok]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "latency_p50_ms": _ms(percentile(latencies, 50)) if latencies else None,
+        "latency_p95_ms": _ms(percentile(latencies, 95)) if latencies else None,
+        "time_to_first_token_p50_ms": _ms(percentile(first_tokens, 50)) if first_tokens else None,
+        "tokens_per_sec": eval_count / (eval_duration / 1e9) if eval_duration else None,
+        "prompt_tokens_per_sec": prompt_count / (prompt_duration / 1e9) if prompt_duration else None,
+        "load_duration_ms": _ms(max(loads)) if loads else None,
+    }
+
+
+def _ms(nanoseconds):
+    return round(nanoseconds / 1e6, 2)
+
+
+def compare(report, baseline):
+    """Percentage change of each model's headline numbers against an earlier report."""
+    changes = {}
+    for model, summary in report["models"].items():
+        previous = baseline.get("models", {}).get(model)
+        if not previous:
+            continue
+        changes[model] = {
+            metric: round((summary[metric] - previous[metric]) / previous[metric] * 100, 1)
+            for metric in ("latency_p50_ms", "latency_p95_ms", "tokens_per_sec", "prompt_tokens_per_sec")
+            if summary.get(metric) and previous.get(metric)
+        }
+    return changes
+
+
+def print_report(report):
+    print(f'{"model":<22} {"reqs":>5} {"err":>4} {"p50 ms":>10} {"p95 ms":>10} {"tok/s":>8} {"prompt tok/s":>13} {"load ms":>10}')
+    for model, summary in report["models"].items():
+        print(f'{model:<22} {summary["requests"]:>5} {summary["errors"]:>4} '
+              f'{_fmt(summary["latency_p50_ms"]):>10} {_fmt(summary["latency_p95_ms"]):>10} '
+              f'{_fmt(summary["tokens_per_sec"]):>8} {_fmt(summary["prompt_tokens_per_sec"]):>13} '
+              f'{_fmt(summary["load_duration_ms"]):>10}')
+    for model, changes in report.get("compared_to_baseline", {}).items():
+        print(f"{model} vs baseline: " + ", ".join(f"{metric} {change:+.1f}%" for metric, change in changes.items()))
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark review latency and throughput per model.")
+    parser.add_argument("--url", help="Ollama /api/chat endpoint (defaults to a local stub server)")
+    parser.add_argument("--models", help="comma separated model tags (defaults to the .devcontainer models)")
+    parser.add_argument("--corpus", help="directory of review inputs (defaults to the sample SQL, split by CTE)")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay the corpus per model")
+    parser.add_argument("--stream", action="store_true", help="stream replies to measure time to first token")
+    parser.add_argument("--time-scale", type=float, default=0.001, help="stub only: multiply simulated durations")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds to wait for each reply")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="where benchmark reports are written")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    models = [model.strip() for model in args.models.split(",")] if args.models else devcontainer_models()
+    corpus = benchmark_corpus(args.corpus)
+    stub = None if args.url else StubOllama(time_scale=args.time_scale).start()
+    url = args.url or stub.url
+    session = requests.Session()
+    client = ReviewClient(url, session=session, timeout=args.timeout)
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    samples = []
+    try:
+        for model in models:
+            print(f"benchmarking {model} over {len(corpus)} inputs x {args.repeat}", file=sys.stderr)
+            samples.extend(run_model(client, model, corpus, repeat=args.repeat, stream=args.stream))
+    finally:
+        session.close()
+        if stub:
+            stub.stop()
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "target": url if args.url else f"stub (time_scale={args.time_scale})",
+        "stream": args.stream,
+        "corpus": {"inputs": len(corpus), "repeat": args.repeat, "digest": corpus_digest(corpus)},
+        "models": {model: summarise([s for s in samples if s["model"] == model]) for model in models},
+        "samples": samples,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            report["compared_to_baseline"] = compare(report, json.load(file))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print_report(report)
+    print(f"report written to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
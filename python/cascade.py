@@ -0,0 +1,129 @@
+import json
+import re
+from dataclasses import dataclass
+
+from ollama_client import strip_reasoning
+from reasoning import END_MARKER
+
+TRIAGE_INSTRUCTION = (f"After the review and before {END_MARKER}, write one line in exactly this form: "
+                      "TRIAGE: severity=<none|low|medium|high> confidence=<0-100>")
+HEDGES = ("not sure", "unsure", "unclear", "hard to say", "cannot determine", "can't tell",
+          "without more context", "might be", "possibly")
+
+_TRIAGE_LINE = re.compile(r"TRIAGE:\s*severity\s*=\s*(none|low|medium|high)\s+confidence\s*=\s*(\d{1,3})", re.IGNORECASE)
+
+
+@dataclass
+class CascadePolicy:
+    """Models from cheapest to most capable; a unit moves up a tier when the current reply is flagged or unsure."""
+
+    tiers: list
+    min_confidence: float = 0.6
+    escalate_severities: tuple = ("medium", "high")
+    flag_pattern: str = ""
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as file:
+            config = json.load(file)
+        return cls(
+            tiers=list(config["tiers"]),
+            min_confidence=config.get("min_confidence", cls.min_confidence),
+            escalate_severities=tuple(config.get("escalate_severities", cls.escalate_severities)),
+            flag_pattern=config.get("flag_pattern", ""),
+        )
+
+
+def assess(data, policy):
+    """Score a reply: severity and confidence from its TRIAGE line, lowered for truncation and hedging."""
+    answer = strip_reasoning(data["message"]["content"])
+    triage = _TRIAGE_LINE.search(answer)
+    severity = triage.group(1).lower() if triage else None
+    confidence = min(int(triage.group(2)), 100) / 100 if triage else 0.5
+    reasons = [] if triage else ["no triage line"]
+
+    if data.get("done_reason") == "length":
+        confidence = 0.0
+        reasons.append("reply truncated")
+    if not answer:
+        confidence = 0.0
+        reasons.append("empty answer")
+    hedges = sum(answer.lower().count(hedge) for hedge in HEDGES)
+    if hedges:
+        confidence = max(0.0, confidence - 0.1 * min(hedges, 4))
+        reasons.append(f"{hedges} hedges")
+
+    flagged = severity in policy.escalate_severities
+    if flagged:
+        reasons.append(f"severity {severity}")
+    if policy.flag_pattern and re.search(policy.flag_pattern, answer):
+        flagged = True
+        reasons.append("matched flag pattern")
+    if confidence < policy.min_confidence:
+        reasons.append(f"confidence {confidence:.2f} < {policy.min_confidence}")
+    return {
+        "severity": severity,
+        "confidence": round(confidence, 2),
+        "flagged": flagged,
+        "escalate": flagged or confidence < policy.min_confidence,
+        "reasons": reasons,
+    }
+
+
+def triage_messages(messages):
+    *prefix, last = messages
+    return prefix + [{**last, "content": f"{last['content']}\n{TRIAGE_INSTRUCTION}"}]
+
+
+def review_with_cascade(client, messages, policy=None, chunk_id=None, queue_wait=0, options=None):
+    """Review with the cheapest tier first, escalating while the policy says so; without a policy send once.
+
+    options (e.g. num_predict) apply to every tier. The returned reply gains `tier` and a `cascade` list with
+    the assessment made at each tier.
+    """
+    if not policy:
+        return client.send(messages, chunk_id=chunk_id, queue_wait=queue_wait, options=options)
+
+    messages = triage_messages(messages)
+    attempts = []
+    for tier, model in enumerate(policy.tiers):
+        data = client.send(messages, model=model, chunk_id=chunk_id, queue_wait=queue_wait if tier == 0 else 0,
+                           options=options)
+        assessment = assess(data, policy)
+        attempts.append({"tier": tier, "model": model, "eval_count": data.get("eval_count", 0), **assessment})
+        if not assessment["escalate"]:
+            break
+    data["tier"] = tier
+    data["cascade"] = attempts
+    return data
+
+
+def describe_tier(data):
+    """One line saying which tier answered and why lower tiers escalated."""
+    attempts = data.get("cascade")
+    if not attempts:
+        return f"Reviewed by {data['model']}"
+    final = attempts[-1]
+    line = f"Reviewed by tier {final['tier']} ({final['model']})"
+    escalations = [f"{attempt['model']}: {', '.join(attempt['reasons'])}" for attempt in attempts[:-1]]
+    if escalations:
+        line += "; escalated from " + "; ".join(escalations)
+    return line
+
+
+def add_cascade_args(parser):
+    parser.add_argument("--cascade", help="comma separated models, cheapest first, e.g. deepseek-r1:1.5b,deepseek-r1:14b")
+    parser.add_argument("--cascade-config", help="JSON file with tiers, min_confidence, escalate_severities, flag_pattern")
+    parser.add_argument("--min-confidence", type=float, help="escalate replies scoring below this (0-1)")
+
+
+def policy_from_args(args):
+    if args.cascade_config:
+        policy = CascadePolicy.from_file(args.cascade_config)
+    elif args.cascade:
+        policy = CascadePolicy(tiers=[model.strip() for model in args.cascade.split(",") if model.strip()])
+    else:
+        return None
+    if args.min_confidence is not None:
+        policy.min_confidence = args.min_confidence
+    return policy
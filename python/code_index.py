@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import requests
+
+from ollama_client import estimate_tokens
+from prompt_compaction import compact_sql
+from sql_chunker import FINAL_CHUNK_NAME
+
+DEFAULT_INDEX_DIR = ".code-review/index"
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_TOP_K = 4
+DEFAULT_CONTEXT_TOKENS = 800
+# Definitions less similar than this to a unit are not worth their tokens unless the unit references them.
+MIN_SIMILARITY = 0.5
+EMBED_BATCH = 32
+# Longest definition body kept; the start of a function or CTE says most about what it produces.
+MAX_DEFINITION_LINES = 40
+# Only the start of a unit is embedded to look up similar definitions.
+MAX_QUERY_CHARS = 4000
+
+RELATED_NOTE = ("The definitions below are referenced by or similar to this code and are reviewed separately; "
+                "use them to understand the code, but report findings only for the code itself.")
+
+_SQL_CREATE = re.compile(r"\bcreate\s+(?:or\s+replace\s+)?(?:temp(?:orary)?\s+)?(table|view|materialized\s+view|"
+                         r"function|procedure)\s+(?:if\s+not\s+exists\s+)?([\w.\"`\[\]]+)", re.IGNORECASE)
+_CODE_DEFINITION = re.compile(r"^([ \t]*)(?:export\s+)?(?:async\s+)?(?:def|class|function|func|fn)\s+(\w+)",
+                              re.MULTILINE)
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class Definition:
+    name: str
+    kind: str
+    path: str
+    unit_id: str
+    text: str
+    start_line: int
+    end_line: int
+    # Definitions only visible inside their own file (CTEs) are not offered to other files.
+    local: bool = False
+
+    @property
+    def key(self):
+        return f"{self.path}:{self.start_line}:{self.name}"
+
+
+@dataclass
+class Related:
+    definition: Definition
+    reason: str
+    score: float = 0.0
+
+
+@dataclass
+class _StatementPart:
+    id: str
+    path: str
+    name: str
+    text: str
+    start_line: int
+    end_line: int
+
+
+class EmbeddingCache:
+    """Embeddings from Ollama's /api/embed, kept on disk by model and text hash so only new text is embedded."""
+
+    def __init__(self, url, model=DEFAULT_EMBED_MODEL, directory=DEFAULT_INDEX_DIR, session=None, timeout=300):
+        self.url = url.rsplit("/api/", 1)[0] + "/api/embed"
+        self.model = model
+        self.path = os.path.join(directory, re.sub(r"[^A-Za-z0-9._-]+", "_", model) + ".json")
+        self.session = session
+        self.timeout = timeout
+        self.embedded = 0
+        self._vectors = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as file:
+                    self._vectors = json.load(file)
+            except ValueError:
+                self._vectors = {}
+
+    def embed(self, texts):
+        """A vector for each text, asking Ollama only for those not embedded before."""
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        missing = list({key: text for key, text in zip(keys, texts) if key not in self._vectors}.items())
+        http = self.session or requests
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = missing[start:start + EMBED_BATCH]
+            response = http.post(self.url, json={"model": self.model, "input": [text for _, text in batch]},
+                                 timeout=self.timeout)
+            response.raise_for_status()
+            vectors = response.json()["embeddings"]
+            with self._lock:
+                self._vectors.update((key, vector) for (key, _), vector in zip(batch, vectors))
+            self.embedded += len(batch)
+        if missing:
+            self.save()
+        return [self._vectors[key] for key in keys]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with self._lock, open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._vectors, file)
+        os.replace(temp_path, self.path)
+
+
+class CodeIndex:
+    """Definitions (CTEs, tables, views, functions, classes) in the reviewed code and which units reference them.
+
+    related() picks the context a unit needs: first the definitions it references (the CTEs it reads from,
+    tables it queries, functions it calls), then, with embeddings, the definitions most similar to it, up to
+    top_k of them and max_tokens in total.
+    """
+
+    def __init__(self, embeddings=None, top_k=DEFAULT_TOP_K, max_tokens=DEFAULT_CONTEXT_TOKENS):
+        self.embeddings = embeddings
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.definitions = []
+        self._by_name = {}
+        # Built by embed(): unit-length definition vectors (one row per definition), which rows any file may be
+        # sent, each definition's row by key, and the rows of each ("path", path) and ("unit", id).
+        self._matrix = None
+        self._shared = None
+        self._rows = {}
+        self._rows_by = {}
+
+    def add_units(self, units):
+        """Index units (anything with id, path, name, text, start_line and end_line)."""
+        for unit in units:
+            for definition in unit_definitions(unit):
+                self.definitions.append(definition)
+                self._by_name.setdefault(_normalize(definition.name), []).append(definition)
+        self._matrix = None
+        return self
+
+    def references(self, unit):
+        """Definitions elsewhere that unit refers to by name, in the order it first mentions them."""
+        own = {definition.key for definition in unit_definitions(unit)}
+        found = []
+        seen = set()
+        for word in _WORD.findall(unit.text):
+            for definition in self._by_name.get(_normalize(word), []):
+                if (definition.key in own or definition.key in seen or definition.unit_id == unit.id
+                        or (definition.local and definition.path != unit.path)):
+                    continue
+                seen.add(definition.key)
+                found.append(definition)
+        return found
+
+    def related(self, unit):
+        """The definitions to send with unit, most relevant first, within top_k and max_tokens."""
+        candidates = [Related(definition, "referenced", 1.0) for definition in self.references(unit)]
+        if self.embeddings and self.definitions:
+            chosen = {related.definition.key for related in candidates}
+            scores, eligible = self._similarities(unit)
+            for related in candidates:
+                related.score += float(scores[self._rows[related.definition.key]])
+            candidates.sort(key=lambda related: related.score, reverse=True)
+            similar = np.flatnonzero(eligible & (scores >= MIN_SIMILARITY))
+            candidates += sorted(
+                (Related(self.definitions[row], "similar", float(scores[row])) for row in similar.tolist()
+                 if self.definitions[row].key not in chosen),
+                key=lambda related: related.score, reverse=True)
+        selected = []
+        budget = self.max_tokens
+        for related in candidates:
+            if len(selected) == self.top_k:
+                break
+            # A method inside a class already chosen (or the class around a chosen method) would repeat its lines.
+            if any(_overlaps(related.definition, chosen.definition) for chosen in selected):
+                continue
+            cost = estimate_tokens(render_definition(related.definition))
+            if cost <= budget:
+                selected.append(related)
+                budget -= cost
+        return selected
+
+    def context(self, unit):
+        """A <related_definitions> block for unit, or None when nothing relevant fits."""
+        selected = self.related(unit)
+        if not selected:
+            return None
+        body = "\n".join(render_definition(related.definition) for related in selected)
+        return f"<related_definitions>\n{body}\n</related_definitions>"
+
+    def embed(self, units=()):
+        """Embed every definition and the given units up front, so Ollama gets a few large batches."""
+        if self._matrix is None:
+            vectors = self.embeddings.embed([definition.text for definition in self.definitions])
+            self._matrix = _unit_rows(np.array(vectors, dtype=np.float32).reshape(len(self.definitions), -1)
+                                      if vectors else np.zeros((0, 1), dtype=np.float32))
+            self._shared = np.array([not definition.local for definition in self.definitions])
+            self._rows = {definition.key: row for row, definition in enumerate(self.definitions)}
+            self._rows_by = {}
+            for row, definition in enumerate(self.definitions):
+                self._rows_by.setdefault(("path", definition.path), []).append(row)
+                self._rows_by.setdefault(("unit", definition.unit_id), []).append(row)
+        self.embeddings.embed([unit.text[:MAX_QUERY_CHARS] for unit in units])
+
+    def _similarities(self, unit):
+        """Cosine similarity of unit to every definition, and which definitions may be sent with it.
+
+        A definition may be sent unless it is the unit's own or local to another file (a CTE elsewhere).
+        """
+        self.embed()
+        query = _unit_rows(np.array([self.embeddings.embed([unit.text[:MAX_QUERY_CHARS]])[0]], dtype=np.float32))
+        scores = self._matrix @ query[0]
+        eligible = self._shared.copy()
+        eligible[self._rows_by.get(("path", unit.path), [])] = True
+        eligible[self._rows_by.get(("unit", unit.id), [])] = False
+        return scores, eligible
+
+
+def unit_definitions(unit):
+    """What a unit defines: a CTE unit defines its CTE; files define their CREATE statements, functions and classes."""
+    lines = unit.text.split("\n")
+    is_sql = unit.path.lower().endswith(".sql")
+    definitions = []
+    if is_sql and unit.name and unit.name != FINAL_CHUNK_NAME:
+        definitions.append(Definition(unit.name, "cte", unit.path, unit.id, _sql_body(unit.text),
+                                      unit.start_line, unit.end_line, local=True))
+    if is_sql:
+        for match in _SQL_CREATE.finditer(unit.text):
+            first = unit.text.count("\n", 0, match.start())
+            end = unit.text.find(";", match.end())
+            body = unit.text[match.start():end + 1 if end >= 0 else len(unit.text)]
+            name = match.group(2).strip("\"`[]").rsplit(".", 1)[-1]
+            definitions.append(Definition(name, match.group(1).lower(), unit.path, unit.id, _sql_body(body),
+                                          unit.start_line + first, unit.start_line + first + body.count("\n")))
+        return definitions
+    for match in _CODE_DEFINITION.finditer(unit.text):
+        first = unit.text.count("\n", 0, match.start())
+        last = _block_end(lines, first, len(match.group(1).expandtabs()))
+        body = "\n".join(lines[first:min(last + 1, first + MAX_DEFINITION_LINES)])
+        kind = "class" if "class" in match.group(0).split() else "function"
+        definitions.append(Definition(match.group(2), kind, unit.path, unit.id, body,
+                                      unit.start_line + first, unit.start_line + last))
+    return definitions
+
+
+def render_definition(definition):
+    return (f'<definition name="{definition.name}" kind="{definition.kind}" path="{definition.path}" '
+            f'lines="{definition.start_line}-{definition.end_line}">\n{definition.text}\n</definition>')
+
+
+def _unit_rows(matrix):
+    # With every row scaled to length 1, a dot product is the cosine similarity.
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _sql_body(sql):
+    lines = compact_sql(sql, strip_comments=True).text.split("\n")
+    return "\n".join(line.split("|", 1)[1] for line in lines[:MAX_DEFINITION_LINES])
+
+
+def _block_end(lines, first, indent):
+    """Last line of the block starting at lines[first]: until a non-blank line indented no deeper than it."""
+    last = first
+    for index in range(first + 1, len(lines)):
+        line = lines[index]
+        if not line.strip():
+            continue
+        if len(line) - len(line.lstrip()) <= indent and not line.lstrip().startswith(("}", ")", "]")):
+            break
+        last = index
+    return last
+
+
+def _overlaps(left, right):
+    return left.path == right.path and left.start_line <= right.end_line and right.start_line <= left.end_line
+
+
+def _normalize(name):
+    return name.lower()
+
+
+def index_from_args(args, session=None):
+    """A CodeIndex for --related, with embeddings (cached in <output-dir>/index) unless --no-embed; else None."""
+    if not args.related:
+        return None
+    embeddings = None
+    if not args.no_embed:
+        directory = args.index_dir or os.path.join(args.output_dir, "index")
+        embeddings = EmbeddingCache(args.url.split(",")[0].strip(), model=args.embed_model, directory=directory,
+                                    session=session)
+    return CodeIndex(embeddings, top_k=args.related_top_k, max_tokens=args.related_tokens)
+
+
+def add_index_args(parser):
+    parser.add_argument("--related", action="store_true",
+                        help="send each unit the definitions it references or resembles (CTEs, tables, functions)")
+    parser.add_argument("--related-top-k", type=int, default=DEFAULT_TOP_K, help="most related definitions per unit")
+    parser.add_argument("--related-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for related definitions per unit")
+    parser.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL, help="Ollama embedding model for --related")
+    parser.add_argument("--no-embed", action="store_true", help="use only the reference graph, without embeddings")
+    parser.add_argument("--index-dir", help="where embeddings are cached (default <output-dir>/index)")
+
+
+def unit_contexts(index, units):
+    """{unit id: related definitions block} for units; embeddings are dropped (with a warning) if Ollama fails."""
+    if index.embeddings:
+        try:
+            index.embed(units)
+        except (requests.RequestException, KeyError, ValueError) as error:
+            print(f"warning: embeddings unavailable ({error}); using the reference graph only", file=sys.stderr)
+            index.embeddings = None
+    contexts = {unit.id: index.context(unit) for unit in units}
+    return {unit_id: block for unit_id, block in contexts.items() if block}
+
+
+def statement_contexts(chunks, path="statement.sql", top_k=DEFAULT_TOP_K, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """{chunk name: related definitions block} for the CTE chunks (sql_chunker.split_ctes) of one statement.
+
+    Uses the reference graph alone, so each chunk is sent the CTEs it reads from without an embedding model.
+    """
+    parts = [_StatementPart(chunk.name, path, chunk.name, chunk.text, chunk.start_line, chunk.end_line)
+             for chunk in chunks]
+    index = CodeIndex(top_k=top_k, max_tokens=max_tokens).add_units(parts)
+    contexts = {part.id: index.context(part) for part in parts}
+    return {name: block for name, block in contexts.items() if block}
@@ -1,123 +1,313 @@
-import requests
-import json
-import datetime
-from ast import literal_eval
-
-def review_code():    
-    url = "http://ollama-service:11434/api/chat"
-    
-
-    context = get_context()
-    planning_rules = get_planning_rules()
-    format_rules = get_format_rules()
-    instruction = "Review this code for me"
+import argparse
+import sys
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+from cascade import add_cascade_args, describe_tier, policy_from_args, review_with_cascade
+from code_index import RELATED_NOTE, statement_contexts
+from ollama_client import DEFAULT_URL, estimate_tokens, make_session, strip_reasoning
+from prompt_compaction import NUMBERED_NOTE, Compaction
+from reasoning import END_INSTRUCTION
+from review_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ReviewCache
+from review_client import DEFAULT_MODEL, ReviewClient
+from scheduler import DEFAULT_HEALTH_INTERVAL, EndpointPool
+from telemetry import DEFAULT_LOG_PATH, Telemetry
+from sql_chunker import FINAL_CHUNK_NAME, chunk_line_numbers, split_ctes
+from sql_lint import findings_between, lint_markdown, lint_sql, lint_summary
+from structured_findings import FINDINGS_SCHEMA, findings_markdown, format_rules, parse_structured
+
+def review_code(client, stream=False, chunked=False, parallel=1, policy=None, lint=True, compaction=None,
+                structured=False):
     code = get_code_for_review()
-    request_content = f"""
-    <context>{context}</context>
-    <planning_rules>{planning_rules}</planning_rules>
-    <format_rules>{format_rules}</format_rules>
-    {instruction}
-    <code>
-    {code}
-    </code>
-    """
+    on_token = print_token if stream else None
+    findings = lint_sql(code) if lint else None
+    if findings is not None:
+        print(lint_markdown(findings))
+    if chunked:
+        data = review_in_chunks(client, code, on_token=on_token, parallel=parallel, policy=policy, findings=findings,
+                                compaction=compaction, structured=structured)
+    elif policy:
+        data = review_with_cascade(client, build_messages("Review this code for me", code, findings, compaction), policy)
+        print(describe_tier(data))
+        print()
+        if stream:
+            print_token(data['message']['content'])
+    else:
+        data = client.send(build_messages("Review this code for me", code, findings, compaction,
+                                          structured=structured), on_token=on_token)
+    if stream:
+        print()
+        print()
+    print_metrics(data)
+    if client.cache:
+        stats = client.cache.stats()
+        print(f'cache            : {stats["hits"]} hits, {stats["misses"]} misses, {stats["evictions"]} evictions')
+    if compaction and compaction.original_tokens:
+        print(compaction.summary())
+    if structured:
+        review_findings, problems = parse_structured(data['message']['content'], FINDINGS_SCHEMA)
+        for problem in problems:
+            print(f'warning: {problem}', file=sys.stderr)
+        print()
+        print(findings_markdown(review_findings))
+        data['findings'] = review_findings
+    elif not stream:
+        print()
+        print(data['message']['content'])
+    return data
 
-    payload = {
-        "model": "deepseek-r1:14b",
-        "messages": [
-            {"role": "user", "content": request_content}
-        ],
-        "stream": False
-    }
-    response = requests.post(url, json=payload)
-    print(response.status_code)    # e.g. 200 if successful
-    # print(response.text)           # the raw text output
-    data = response.json()
-    # print(data)
-    model = data['model']
-    created_at = data['created_at']
-    message = data['message']
-    role = message['role']
-    content = message['content']
-    done_reason = data['done_reason']
-    done = data['done']
-    total_duration = data['total_duration']
-    load_duration = data['load_duration']
-    prompt_eval_count = data['prompt_eval_count']
-    eval_count = data['eval_count']
-    eval_duration = data['eval_duration']
-
-    print(f'model            :{model}')
-    print(f'total_duration   :{total_duration}')
-    print(f'prompt_eval_count: {prompt_eval_count}')
-    print(f'eval_count       : {eval_count}')
-    print()
-    print(content)
 
+def system_prompt(linted=False, structured=False):
+    """The rules shared by every request, kept byte-identical so Ollama can reuse the evaluated prefix."""
+    planning_rules = textwrap.dedent(get_planning_rules(linted)).strip()
+    return (f"<context>{get_context()}</context>\n"
+            f"<planning_rules>\n{planning_rules}\n</planning_rules>\n"
+            f"<format_rules>{get_format_rules(structured)}</format_rules>")
 
-    
 
+def build_messages(instruction, code, findings=None, compaction=None, line_numbers=None, structured=False,
+                   related=None):
+    """With lint findings (even an empty list) the mechanical rules are left to the linter and its summary is sent instead.
 
+    With a compaction the code is sent compacted, each line numbered from line_numbers (1, 2, ... by default).
+    structured asks for findings as JSON matching FINDINGS_SCHEMA (the client must send it as the format).
+    related is a <related_definitions> block (code_index.CodeIndex.context) sent ahead of the code for reference.
     """
-    curl http://localhost:11434/api/chat -d '{
-    "model": "deepseek-r1",
-    "messages": [{ "role": "user", "content": "Solve: 25 * 25" }],
-    "stream": false
-    }'
-    """
+    if compaction:
+        code = compaction.apply(code, line_numbers).text
+        instruction = f"{instruction} {NUMBERED_NOTE}"
+    if related:
+        instruction = f"{instruction} {RELATED_NOTE}\n{related}"
+    if findings is None:
+        return [
+            {"role": "system", "content": system_prompt(structured=structured)},
+            {"role": "user", "content": f"{instruction}\n<code>\n{code}\n</code>"},
+        ]
+    return [
+        {"role": "system", "content": system_prompt(linted=True, structured=structured)},
+        {"role": "user", "content": f"{instruction}\n<lint_results>\n{lint_summary(findings)}\n</lint_results>\n"
+                                    f"<code>\n{code}\n</code>"},
+    ]
 
-    """
-    <context>
-    You are a senior software engineer specializing in debugging. Analyze error messages, identify root causes, and provide concise fixes. Prioritize solutions that prevent recurrence.
-    </context>
-
-    <planning_rules>
-    - Reproduce the error locally first
-    - Isolate the faulty component
-    - Test the fix in a sandboxed environment
-    </planning_rules>
-
-    <format_rules>
-    - Present errors as: [ERROR TYPE]: [DESCRIPTION]
-    - Explain causes in plain English
-    - Offer code snippets with before/after comparisons
-    </format_rules>
-    """
 
+def review_in_chunks(client, code, on_token=None, parallel=1, policy=None, findings=None, compaction=None,
+                     structured=False):
+    """Map-reduce review: one request per CTE, then one request merging the partial findings.
 
+    With a cascade policy each CTE is triaged by the cheapest tier first; the reduce step uses the client's model.
+    Lint findings for the whole statement are handed to each CTE by line range, and each CTE is sent the
+    definitions of the CTEs it reads from.
     """
-    <!-- from https://www.youtube.com/watch?app=desktop&v=kRXfddrtrmM -->
-    **Instruction**: {instruction}
+    chunks = split_ctes(code)
+    if len(chunks) == 1:
+        return client.send(build_messages("Review this code for me", code, findings, compaction,
+                                          structured=structured), on_token=on_token)
 
-    **Goal**: {goal}
+    contexts = statement_contexts(chunks)
 
-    **Model settings**:
-    - Temperature: 0.7
-    - Max tokens: 300
-    """
+    def review_chunk(chunk):
+        chunk_findings = None if findings is None else findings_between(findings, chunk.start_line, chunk.end_line)
+        messages = build_messages(chunk_instruction(chunk), chunk.text, chunk_findings, compaction,
+                                  chunk_line_numbers(chunk), structured, contexts.get(chunk.name))
+        return review_with_cascade(client, messages, policy, chunk_id=chunk.name)
 
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        partials = list(executor.map(review_chunk, chunks))
+
+    for chunk, partial in zip(chunks, partials):
+        print(f'{chunk.name:<34} lines {chunk.start_line}-{chunk.end_line}  '
+              f'prompt_eval_count {partial["prompt_eval_count"]}  eval_count {partial["eval_count"]}  '
+              f'{partial["model"]}')
+    print()
+
+    reviews = [partial_review(chunk.name, chunk.start_line, chunk.end_line, partial["model"],
+                              partial["message"]["content"])
+               for chunk, partial in zip(chunks, partials)]
+    data = reduce_reviews(client, reviews, linted=findings is not None, structured=structured, on_token=on_token)
+    data['chunks'] = [
+        {
+            "name": chunk.name,
+            "start_line": chunk.start_line,
+            "end_line": chunk.end_line,
+            "total_duration": partial["total_duration"],
+            "prompt_eval_count": partial["prompt_eval_count"],
+            "eval_count": partial["eval_count"],
+            "cache_hit": partial["cache_hit"],
+            "reviewed_by": describe_tier(partial),
+        }
+        for chunk, partial in zip(chunks, partials)
+    ]
+    return data
+
+
+def chunk_instruction(chunk, path=None):
+    instruction = "Review this code for me."
+    if path:
+        instruction += f" It is from `{path}`."
+    if chunk.name == FINAL_CHUNK_NAME:
+        instruction += (f" It is the final query of a larger SQL statement (lines {chunk.start_line}-{chunk.end_line});"
+                        " other parts are reviewed separately.")
+    elif chunk.name:
+        instruction += (f" It is the CTE `{chunk.name}` from a larger SQL statement"
+                        f" (lines {chunk.start_line}-{chunk.end_line}); other parts are reviewed separately.")
+    if chunk.depends_on:
+        instruction += f" It reads from these CTEs defined elsewhere in the statement: {', '.join(chunk.depends_on)}."
+    return instruction
+
+
+def partial_review(part, start_line, end_line, model, content):
+    return {"part": part, "start_line": start_line, "end_line": end_line, "model": model,
+            "text": (f'<partial_review part="{part}" lines="{start_line}-{end_line}" model="{model}">\n'
+                     f'{strip_reasoning(content)}\n'
+                     f'</partial_review>')}
+
+
+def reduce_reviews(client, reviews, linted=False, structured=False, on_token=None):
+    """Merge partial reviews into one report, in rounds when they would not fit in one context window.
+
+    Each round merges runs of neighbouring reviews that fit in one request (client.prompt_budget) and hands
+    the merged reviews to the next, until one request can take them all. A review too large to share a
+    request is passed on as it is; if no two reviews fit together the final request is sent regardless.
     """
-    <think>
-    A successful product launch email  should be clear , engaging, and action orientated.
-    It should introduce the product, highlight key benefits and encourage the reader to engage.
-    A semi-formal tone balances professionalism with approachability.
-    </think>
-    <answer>
-    Write a concise, semi-formal email introducing a new product.
-    - open with an engaging hook.
-    - Highlight key features and benefits.
-    - Include clear call to action (e.g. website link, sign up, purchase).
-    - Keep tone professional yet approachable.
-    </answer>
-    """
+    budget = client.prompt_budget() - sum(estimate_tokens(m["content"]) for m in reduce_messages([], linted, structured))
+    rounds = 0
+    while True:
+        groups = group_reviews(reviews, budget)
+        if len(groups) == 1 or len(groups) == len(reviews):
+            break
+        rounds += 1
+        merged = []
+        for index, group in enumerate(groups):
+            if len(group) == 1:
+                merged.extend(group)
+                continue
+            data = client.send(reduce_messages(group, linted, structured), chunk_id=f"reduce-{rounds}.{index}")
+            merged.append(partial_review(f'{group[0]["part"]} to {group[-1]["part"]}', group[0]["start_line"],
+                                         group[-1]["end_line"], data["model"], data["message"]["content"]))
+        print(f'reduce round {rounds}: merged {len(reviews)} partial reviews into {len(merged)}')
+        reviews = merged
+    data = client.send(reduce_messages(reviews, linted, structured), on_token=on_token, chunk_id="reduce")
+    data["reduce_rounds"] = rounds
+    return data
+
+
+def group_reviews(reviews, budget):
+    """Split reviews, in order, into runs whose combined size stays within budget tokens."""
+    groups = []
+    size = 0
+    for review in reviews:
+        tokens = estimate_tokens(review["text"]) + 1
+        if groups and size + tokens <= budget:
+            groups[-1].append(review)
+            size += tokens
+        else:
+            groups.append([review])
+            size = tokens
+    return groups
+
+
+def reduce_messages(reviews, linted=False, structured=False):
+    instruction = ("The SQL statement was too large to review in one request, so each CTE and the final query were "
+                   "reviewed separately. Merge these partial reviews into a single report. Remove duplicate findings, "
+                   "keep the line references and the model that produced each finding, and call out issues that "
+                   "span more than one CTE.")
+    body = "\n".join(review["text"] for review in reviews)
+    return [
+        {"role": "system", "content": system_prompt(linted, structured)},
+        {"role": "user", "content": f"{instruction}\n{body}"},
+    ]
 
-    
 
-    
+def print_token(token):
+    sys.stdout.write(token)
+    sys.stdout.flush()
+
+def print_metrics(data):
+    print(f'model            :{data["model"]}')
+    print(f'total_duration   :{data["total_duration"]}')
+    print(f'load_duration    :{data["load_duration"]}')
+    print(f'prompt_eval_count: {data["prompt_eval_count"]}')
+    print(f'eval_count       : {data["eval_count"]}')
+    print(f'eval_duration    : {data["eval_duration"]}')
+    if data.get('reasoning_tokens') is not None:
+        print(f'reasoning_tokens : {data["reasoning_tokens"]}')
+        print(f'answer_tokens    : {data["answer_tokens"]}')
+        if data.get('stopped') or data.get('steered'):
+            print(f'stopped early    : {"reasoning cut short, steered to answer" if data.get("steered") else data["stopped"]}')
+    if data.get('load_duration_saved') or data.get('prompt_eval_saved'):
+        print(f'load_duration saved : {data["load_duration_saved"] / 1e6:.0f}ms')
+        print(f'prompt_eval saved   : {data["prompt_eval_saved"] / 1e6:.0f}ms '
+              f'(~{data["prompt_tokens_reused"]} prompt tokens reused)')
+    if data.get('time_to_first_token') is not None:
+        print(f'time_to_first_token: {data["time_to_first_token"] / 1e6:.0f}ms')
+        latency = data['inter_token_latency']
+        if latency['count']:
+            print(f'inter_token_latency: mean {latency["mean"] / 1e6:.1f}ms, '
+                  f'p95 {latency["p95"] / 1e6:.1f}ms, max {latency["max"] / 1e6:.1f}ms')
+
+# Reference notes kept from the first version of this script.
+#
+# Calling Ollama directly:
+#
+#     curl http://localhost:11434/api/chat -d '{
+#     "model": "deepseek-r1",
+#     "messages": [{ "role": "user", "content": "Solve: 25 * 25" }],
+#     "stream": false
+#     }'
+#
+# A sample prompt in the same context/planning/format shape as get_context, get_planning_rules and get_format_rules:
+#
+#     <context>
+#     You are a senior software engineer specializing in debugging. Analyze error messages, identify root causes, and provide concise fixes. Prioritize solutions that prevent recurrence.
+#     </context>
+#
+#     <planning_rules>
+#     - Reproduce the error locally first
+#     - Isolate the faulty component
+#     - Test the fix in a sandboxed environment
+#     </planning_rules>
+#
+#     <format_rules>
+#     - Present errors as: [ERROR TYPE]: [DESCRIPTION]
+#     - Explain causes in plain English
+#     - Offer code snippets with before/after comparisons
+#     </format_rules>
+#
+# An instruction template, from https://www.youtube.com/watch?app=desktop&v=kRXfddrtrmM
+#
+#     **Instruction**: {instruction}
+#
+#     **Goal**: {goal}
+#
+#     **Model settings**:
+#     - Temperature: 0.7
+#     - Max tokens: 300
+#
+# A sample of the <think>/<answer> shape reasoning models reply in:
+#
+#     <think>
+#     A successful product launch email  should be clear , engaging, and action orientated.
+#     It should introduce the product, highlight key benefits and encourage the reader to engage.
+#     A semi-formal tone balances professionalism with approachability.
+#     </think>
+#     <answer>
+#     Write a concise, semi-formal email introducing a new product.
+#     - open with an engaging hook.
+#     - Highlight key features and benefits.
+#     - Include clear call to action (e.g. website link, sign up, purchase).
+#     - Keep tone professional yet approachable.
+#     </answer>
+
 def get_context():
     return "You are a senior software engineer specializing in SQL and Data Engineering. Analyze code for semantic, stylistic and syntactical issues. Provide specific steps to remediate poor code."
 
-def get_planning_rules():
+def get_planning_rules(linted=False):
+    if linted:
+        return """
+        - Ensure SQL is suitable for PostgreSQL
+        - Keyword case, object name case, subqueries and known PostgreSQL incompatibilities are checked by a linter
+          whose results come with the code; only report issues it did not find.
+        """
     return """
         - Ensure SQL is suitable for PostgreSQL
         - Favour CTEs over subqueries
@@ -125,8 +315,10 @@ def get_planning_rules():
         - Object names such as tables, views and columns should be in upper case.
         """
 
-def get_format_rules():
-    return "Return output in markdown."
+def get_format_rules(structured=False):
+    if structured:
+        return format_rules(FINDINGS_SCHEMA)
+    return f"Return output in markdown. {END_INSTRUCTION}"
 
 def get_code_for_review():
     return """
@@ -499,5 +691,95 @@ from
 
     """
 
+def keep_alive_arg(value):
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Review code with a local Ollama model.")
+    parser.add_argument("--stream", action="store_true", help="print tokens as they are generated")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help="Ollama /api/chat endpoint; separate several with commas to spread requests over them")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Ollama model tag")
+    parser.add_argument("--chunked", action="store_true", help="review each CTE separately, then merge the findings")
+    parser.add_argument("--parallel", type=int, default=1, help="concurrent chunk reviews when --chunked")
+    parser.add_argument("--timeout", type=float, default=3600, help="deadline in seconds for each reply")
+    parser.add_argument("--retries", type=int, default=3, help="retries for refused connections and 5xx responses")
+    add_prompt_args(parser)
+    add_client_args(parser)
+    add_cascade_args(parser)
+    return check_prompt_args(parser, parser.parse_args(argv))
+
+
+def add_prompt_args(parser):
+    parser.add_argument("--no-lint", action="store_true", help="leave keyword/name case and subquery rules to the model")
+    parser.add_argument("--no-compact", action="store_true", help="send SQL exactly as written instead of compacted")
+    parser.add_argument("--strip-comments", action="store_true", help="drop SQL comments when compacting")
+    parser.add_argument("--structured", action="store_true",
+                        help="have the model return findings as schema-checked JSON and render the markdown locally")
+
+
+def check_prompt_args(parser, args):
+    if args.structured and (args.cascade or args.cascade_config):
+        parser.error("--structured replies have no TRIAGE line, so they cannot be combined with a cascade")
+    return args
+
+
+def response_format(args):
+    return FINDINGS_SCHEMA if args.structured else None
+
+
+def compaction_from_args(args):
+    return None if args.no_compact else Compaction(strip_comments=args.strip_comments)
+
+
+def add_client_args(parser):
+    parser.add_argument("--num-ctx", type=int, help="context window to request from Ollama")
+    parser.add_argument("--max-num-ctx", type=int,
+                        help="raise num_ctx up to this size (in powers of two) for prompts that would not fit")
+    parser.add_argument("--keep-alive", type=keep_alive_arg,
+                        help="how long Ollama keeps the model loaded after a request, e.g. 30m or -1 for ever")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="where cached reviews are stored")
+    parser.add_argument("--cache-max-bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="evict least recently used reviews beyond this size")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached reviews (fresh results are still stored)")
+    parser.add_argument("--telemetry-log", default=DEFAULT_LOG_PATH, help="rotating JSONL log of every LLM call")
+    parser.add_argument("--no-telemetry", action="store_true", help="do not write the telemetry log")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--health-interval", type=float, default=DEFAULT_HEALTH_INTERVAL,
+                        help="seconds between endpoint health checks when --url lists several")
+    parser.add_argument("--reasoning-budget", type=int, help="most tokens the model may spend inside <think>")
+    parser.add_argument("--on-budget", choices=("steer", "stop"), default="steer",
+                        help="when the budget runs out, steer the model to answer or stop with what it has")
+    parser.add_argument("--no-early-stop", action="store_true",
+                        help="do not ask Ollama to stop generating at END OF REVIEW")
+
+
+def client_from_args(args, session=None, timeout=None, format=None):
+    cache = ReviewCache(args.cache_dir, max_bytes=args.cache_max_bytes, bypass=args.no_cache)
+    telemetry = Telemetry(None if args.no_telemetry else args.telemetry_log)
+    if args.metrics_port:
+        telemetry.start_metrics_server(args.metrics_port)
+    urls = endpoint_urls(args.url)
+    pool = EndpointPool(urls, health_interval=args.health_interval) if len(urls) > 1 else None
+    return ReviewClient(urls[0], model=args.model, session=session, timeout=timeout, cache=cache,
+                        num_ctx=args.num_ctx, keep_alive=args.keep_alive, telemetry=telemetry,
+                        max_num_ctx=args.max_num_ctx, pool=pool, reasoning_budget=args.reasoning_budget,
+                        on_budget=args.on_budget, early_stop=not args.no_early_stop, format=format)
+
+
+def endpoint_urls(value):
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
 if __name__ == "__main__":
-    review_code()
\ No newline at end of file
+    args = parse_args()
+    session = make_session(args.parallel, args.retries, hosts=len(endpoint_urls(args.url)))
+    client = client_from_args(args, session=session, timeout=args.timeout, format=response_format(args))
+    try:
+        review_code(client, stream=args.stream, chunked=args.chunked, parallel=args.parallel,
+                    policy=policy_from_args(args), lint=not args.no_lint, compaction=compaction_from_args(args),
+                    structured=args.structured)
+    finally:
+        session.close()
+        client.telemetry.close()
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+
+from ollama_client import estimate_tokens
+
+# Assumed until a model has been measured (a 14B model on one consumer GPU); the first reply replaces them.
+DEFAULT_EVAL_RATE = 20.0
+DEFAULT_PROMPT_RATE = 400.0
+DEFAULT_REPLY_TOKENS = 1000
+# Weight of the newest measurement in the running averages.
+SMOOTHING = 0.3
+# Replies are not cut shorter than this; below it a reasoning model rarely gets to the answer.
+MIN_NUM_PREDICT = 512
+# Plan to finish with this share of the deadline, leaving the rest for misestimates.
+HEADROOM = 0.9
+
+
+def duration_arg(value):
+    """Seconds from "90", "45m" or "2h"."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value[-1:].lower() in units:
+        return float(value[:-1]) * units[value[-1].lower()]
+    return float(value)
+
+
+@dataclass
+class Rates:
+    eval_rate: float = DEFAULT_EVAL_RATE
+    prompt_rate: float = DEFAULT_PROMPT_RATE
+    reply_tokens: float = DEFAULT_REPLY_TOKENS
+    samples: int = 0
+
+
+class RateProfile:
+    """Running tokens/sec, prompt tokens/sec and reply length per (endpoint, model), from Ollama's own metrics.
+
+    Each value is an exponentially weighted average, so a box that slows down (thermal throttling, running on
+    battery) is noticed within a few replies.
+    """
+
+    def __init__(self, smoothing=SMOOTHING):
+        self.smoothing = smoothing
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, model, data):
+        if data.get("cache_hit"):
+            return
+        eval_count, eval_duration = data.get("eval_count", 0), data.get("eval_duration", 0)
+        prompt_count, prompt_duration = data.get("prompt_eval_count", 0), data.get("prompt_eval_duration", 0)
+        # A reply cut off at its reasoning budget says nothing about how long replies run, and without
+        # Ollama's final chunk its prompt count is only an estimate.
+        budget_stop = data.get("stopped") == "reasoning_budget"
+        with self._lock:
+            rates = self._rates.setdefault((endpoint, model), Rates())
+            if eval_count and eval_duration:
+                rates.eval_rate = self._blend(rates, rates.eval_rate, eval_count / (eval_duration / 1e9))
+                if not budget_stop:
+                    rates.reply_tokens = self._blend(rates, rates.reply_tokens, eval_count)
+            # Tiny prompts (mostly cached) understate the rate.
+            if prompt_count > 32 and prompt_duration and not budget_stop:
+                rates.prompt_rate = self._blend(rates, rates.prompt_rate, prompt_count / (prompt_duration / 1e9))
+            rates.samples += 1
+
+    def _blend(self, rates, old, new):
+        return new if rates.samples == 0 else old + self.smoothing * (new - old)
+
+    def rates(self, model, endpoint=None):
+        """Rates for model on endpoint; without one, the average over every endpoint measured for it."""
+        with self._lock:
+            if endpoint is not None:
+                return replace(self._rates.get((endpoint, model), Rates()))
+            measured = [rates for (_, name), rates in self._rates.items() if name == model and rates.samples]
+        if not measured:
+            return Rates()
+        return Rates(
+            eval_rate=sum(rates.eval_rate for rates in measured) / len(measured),
+            prompt_rate=sum(rates.prompt_rate for rates in measured) / len(measured),
+            reply_tokens=sum(rates.reply_tokens for rates in measured) / len(measured),
+            samples=sum(rates.samples for rates in measured),
+        )
+
+    def predict(self, model, prompt_tokens, num_predict=None, endpoint=None):
+        """Expected seconds to review a prompt of prompt_tokens, its reply capped at num_predict tokens."""
+        rates = self.rates(model, endpoint)
+        reply = rates.reply_tokens if num_predict is None else min(rates.reply_tokens, num_predict)
+        return prompt_tokens / rates.prompt_rate + reply / rates.eval_rate
+
+    def snapshot(self):
+        with self._lock:
+            return [{"endpoint": endpoint, "model": model, "eval_rate": round(rates.eval_rate, 1),
+                     "prompt_rate": round(rates.prompt_rate, 1), "reply_tokens": round(rates.reply_tokens),
+                     "samples": rates.samples}
+                    for (endpoint, model), rates in sorted(self._rates.items())]
+
+    @classmethod
+    def from_telemetry(cls, log_path, smoothing=SMOOTHING):
+        """Seed a profile from the telemetry log of earlier runs, oldest calls first."""
+        profile = cls(smoothing)
+        if not log_path or not os.path.exists(log_path):
+            return profile
+        with open(log_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") == "ok" and not record.get("cache_hit"):
+                    profile.observe(record["endpoint"], record["model"], record)
+        return profile
+
+
+@dataclass
+class Assignment:
+    """How one unit is to be reviewed: which model, any num_predict cap, and what was given up to get there."""
+
+    model: str
+    num_predict: int = None
+    predicted: float = 0.0
+    downgrades: list = field(default_factory=list)
+
+
+class DeadlineScheduler:
+    """Hands out queued units longest first, choosing a model and reply cap for each so the batch meets a deadline.
+
+    Each time a worker takes a unit, the work still queued or in flight is priced with the latest rates and
+    compared with the time left. When it will not fit, the unit is given a proportional share of the time left
+    and downgraded as little as needed to fit it: first a num_predict cap, then each cheaper model in turn
+    (uncapped, then capped). Once a cheaper model is chosen later units do not go back to a costlier one, since
+    alternating would make servers that hold one model at a time reload it. Units already reviewed keep their
+    settings.
+
+    Token rates miss queueing, model loads and contention between parallel requests, so predictions are
+    scaled by slowdown: a running average of how much longer units really took than predicted.
+    """
+
+    def __init__(self, profile, deadline, workers, model, fallback_models=(), started=None):
+        self.profile = profile
+        self.deadline = deadline
+        self.workers = workers
+        self.model = model
+        self.fallback_models = list(fallback_models)
+        self._tier = 0
+        self.started = time.monotonic() if started is None else started
+        self.downgraded = {}
+        self.slowdown = 1.0
+        self._queue = []
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def queue(self, units, messages):
+        """Queue units (their messages by unit id), the ones predicted to take longest first."""
+        tokens = {unit.id: sum(estimate_tokens(message["content"]) for message in messages[unit.id]) for unit in units}
+        with self._lock:
+            self._queue = sorted(((unit, tokens[unit.id]) for unit in units),
+                                 key=lambda item: self._cost(self.model, item[1]), reverse=True)
+
+    def take(self):
+        """The next unit and its Assignment."""
+        with self._lock:
+            unit, tokens = self._queue.pop(0)
+            now = time.monotonic()
+            full = self._cost(self.model, tokens)
+            pending = full + self._pending(now)
+            left = self.deadline * HEADROOM - (now - self.started)
+            load = pending / self.workers
+            assignment = Assignment(self.model, predicted=full)
+            if load > left or self._tier:
+                assignment = self._downgrade(tokens, full * max(0.0, left) / load if load > left else float("inf"))
+                self.downgraded[unit.id] = assignment.downgrades
+            self._in_flight[unit.id] = (now, assignment.predicted)
+            return unit, assignment
+
+    def _downgrade(self, tokens, share):
+        """The least downgraded settings predicted to review tokens within share seconds (the cheapest otherwise)."""
+        ladder = [self.model] + self.fallback_models
+        for tier in range(self._tier, len(ladder)):
+            model = ladder[tier]
+            changes = [f"model {self.model} -> {model}"] if model != self.model else []
+            predicted = self._cost(model, tokens)
+            if changes and predicted <= share:
+                self._tier = tier
+                return Assignment(model, None, predicted, changes)
+            rates = self.profile.rates(model)
+            cap = int((share / self.slowdown - tokens / rates.prompt_rate) * rates.eval_rate)
+            if cap >= MIN_NUM_PREDICT and cap < rates.reply_tokens:
+                self._tier = tier
+                return Assignment(model, cap, self._cost(model, tokens, cap), changes + [f"num_predict {cap}"])
+        self._tier = len(ladder) - 1
+        model = ladder[-1]
+        changes = [f"model {self.model} -> {model}"] if model != self.model else []
+        return Assignment(model, MIN_NUM_PREDICT, self._cost(model, tokens, MIN_NUM_PREDICT),
+                          changes + [f"num_predict {MIN_NUM_PREDICT}", "deadline at risk"])
+
+    def _cost(self, model, tokens, num_predict=None):
+        return self.profile.predict(model, tokens, num_predict) * self.slowdown
+
+    def _pending(self, now):
+        queued = sum(self._cost(self.model, tokens) for _, tokens in self._queue)
+        return queued + sum(max(0.0, predicted - (now - started)) for started, predicted in self._in_flight.values())
+
+    def done(self, unit, endpoint=None, model=None, data=None):
+        """Record a finished unit and learn from its reply's metrics and how long it really took."""
+        with self._lock:
+            started, predicted = self._in_flight.pop(unit.id, (None, 0.0))
+            if data and not data.get("cache_hit") and predicted:
+                ratio = self.slowdown * (time.monotonic() - started) / predicted
+                self.slowdown += self.profile.smoothing * (ratio - self.slowdown)
+        if data:
+            self.profile.observe(endpoint, model, data)
+
+    def predicted_finish(self):
+        """Seconds from the start at which the work still queued or in flight is expected to be done."""
+        with self._lock:
+            now = time.monotonic()
+            return now - self.started + self._pending(now) / self.workers
@@ -0,0 +1,316 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from batch_review import batch_name, collect_units, git, repository_dir
+from code_review import add_client_args, client_from_args, endpoint_urls
+from findings_store import add_store_args, record_summary, store_from_args
+from near_duplicates import jaccard
+from ollama_client import DEFAULT_URL, OllamaError, make_session, strip_reasoning
+from prompt_compaction import Compaction
+from reasoning import END_INSTRUCTION
+from structured_findings import findings_schema, format_rules, parse_structured
+from review_client import DEFAULT_MODEL
+from sql_chunker import chunk_line_numbers
+
+DEFAULT_PROMPTS_DIR = ".claude/prompts"
+DEFAULT_OUTPUT_DIR = ".code-review"
+# Report order is fixed, matching /review-all.
+DOMAINS = {"ARC": "architecture", "SRE": "sre", "SEC": "security", "DAT": "data"}
+SEVERITIES = ("HIGH", "MEDIUM", "LOW")
+MATURITY_LEVELS = ("HYG", "L1", "L2", "L3")
+TITLE_SIMILARITY = 0.6
+
+FINDING_FORMAT = ("List every finding on its own line exactly as:\n"
+                  "FINDING: severity=<HIGH|MEDIUM|LOW> | maturity=<HYG|L1|L2|L3> | location=<file:line> | "
+                  "title=<short title> | recommendation=<one sentence>\n"
+                  "Use the line numbers shown at the start of each code line. If there is nothing to report, "
+                  f"write NO FINDINGS. {END_INSTRUCTION}")
+
+# Pillar names differ per domain, so they are not enumerated: the schema stays part of one shared system prompt.
+FINDING_SCHEMA = findings_schema(pillars=None, extra={"maturity": {"type": "string", "enum": list(MATURITY_LEVELS)}})
+
+_FINDING = re.compile(r"FINDING:\s*severity\s*=\s*(HIGH|MEDIUM|LOW)\s*\|\s*maturity\s*=\s*(HYG|L[123])\s*\|"
+                      r"\s*location\s*=\s*([^|]*?)\s*\|\s*title\s*=\s*([^|]*?)\s*\|\s*recommendation\s*=\s*(.+)",
+                      re.IGNORECASE)
+
+
+def load_prompts(prompts_dir, domains):
+    """{code: {"name", "base", "pillars": {pillar: text}}} read from <prompts_dir>/<domain>/_base.md and *.md."""
+    if not os.path.isdir(prompts_dir):
+        raise FileNotFoundError(f"prompt directory {prompts_dir} not found; copy .claude/ from this repository "
+                                "into the project or pass --prompts-dir")
+    prompts = {}
+    for code in domains:
+        directory = os.path.join(prompts_dir, DOMAINS[code])
+        base_path = os.path.join(directory, "_base.md")
+        pillars = {os.path.splitext(os.path.basename(path))[0]: path
+                   for path in sorted(glob.glob(os.path.join(directory, "*.md"))) if path != base_path}
+        if not os.path.exists(base_path) or not pillars:
+            raise FileNotFoundError(f"{directory} needs _base.md and at least one pillar prompt")
+        prompts[code] = {
+            "name": DOMAINS[code],
+            "base": _read(base_path),
+            "pillars": {pillar: _read(path) for pillar, path in pillars.items()},
+        }
+    return prompts
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read().strip()
+
+
+def system_prompt(structured=False):
+    return ("You are a senior reviewer taking part in a multi-domain code review. Each request gives you the code "
+            "first, then one domain's shared rules and one pillar checklist to review it against.\n"
+            + (format_rules(FINDING_SCHEMA) if structured else FINDING_FORMAT))
+
+
+def pillar_messages(code, base, pillar, structured=False):
+    """The code comes straight after the fixed system message, so every pillar review of a unit shares that prefix."""
+    return [
+        {"role": "system", "content": system_prompt(structured)},
+        {"role": "user", "content": f"{code}\n<domain_rules>\n{base}\n</domain_rules>\n"
+                                    f"<pillar_checklist>\n{pillar}\n</pillar_checklist>\n"
+                                    "Review the code above against this pillar only."},
+    ]
+
+
+def unit_code(unit):
+    if unit.path.lower().endswith(".sql"):
+        text = Compaction().apply(unit.text, chunk_line_numbers(unit)).text
+    else:
+        text = "\n".join(f"{number}|{line}" for number, line in zip(chunk_line_numbers(unit), unit.text.split("\n")))
+    return f'<code path="{unit.path}" lines="{unit.start_line}-{unit.end_line}">\n{text}\n</code>'
+
+
+def parse_findings(content, structured=False):
+    """(findings, problems) from FINDING lines, or from JSON matching FINDING_SCHEMA when structured."""
+    if structured:
+        findings, problems = parse_structured(content, FINDING_SCHEMA)
+        return [{"severity": finding["severity"], "maturity": finding["maturity"], "location": finding["location"],
+                 "title": finding["rule"], "recommendation": finding["recommendation"]} for finding in findings], problems
+    return [
+        {
+            "severity": severity.upper(),
+            "maturity": maturity.upper(),
+            "location": location,
+            "title": title,
+            "recommendation": recommendation.strip(),
+        }
+        for severity, maturity, location, title, recommendation in _FINDING.findall(strip_reasoning(content))
+    ], []
+
+
+def merge_findings(findings):
+    """Collapse findings on the same unit and location with similar titles, keeping the highest severity and
+    every pillar that raised them."""
+    merged = []
+    for finding in sorted(findings, key=lambda f: SEVERITIES.index(f["severity"])):
+        words = set(re.findall(r"\w+", finding["title"].lower()))
+        for existing in merged:
+            if (existing["unit"] == finding["unit"] and existing["location"] == finding["location"]
+                    and jaccard(existing["_words"], words) >= TITLE_SIMILARITY):
+                existing["pillars"] = sorted(set(existing["pillars"]) | {finding["pillar"]})
+                break
+        else:
+            merged.append({**finding, "pillars": [finding["pillar"]], "_words": words})
+    for finding in merged:
+        del finding["_words"]
+        del finding["pillar"]
+    return merged
+
+
+def maturity_status(findings):
+    """pass/partial/fail per level: HIGH fails a level, anything else makes it partial, and levels above the
+    first one that does not pass are locked."""
+    status = {}
+    blocked = False
+    for level in MATURITY_LEVELS:
+        severities = {finding["severity"] for finding in findings if finding["maturity"] == level}
+        if blocked:
+            status[level] = "locked"
+            continue
+        status[level] = "fail" if "HIGH" in severities else "partial" if severities else "pass"
+        blocked = status[level] != "pass"
+    return status
+
+
+def run_domains(units, prompts, client, concurrency=4, structured=False):
+    """Review every unit against every pillar of every domain at once.
+
+    Requests are queued unit by unit, so the ones in flight together carry the same code and Ollama can reuse
+    its evaluated prefix; a unit's wall-clock time is close to that of its slowest pillar.
+    """
+    jobs = [(unit, code, pillar) for unit in units for code in prompts for pillar in prompts[code]["pillars"]]
+    codes = {unit.id: unit_code(unit) for unit in units}
+
+    def review(job):
+        unit, code, pillar = job
+        messages = pillar_messages(codes[unit.id], prompts[code]["base"], prompts[code]["pillars"][pillar], structured)
+        try:
+            data = client.send(messages, chunk_id=f"{unit.id}:{code}:{pillar}")
+        except (requests.RequestException, OllamaError) as error:
+            return {"unit": unit.id, "domain": code, "pillar": pillar, "status": "error", "error": str(error)}
+        findings, problems = parse_findings(data["message"]["content"], structured)
+        return {
+            "unit": unit.id,
+            "domain": code,
+            "pillar": pillar,
+            "status": "done",
+            "model": data["model"],
+            "findings": [{**finding, "unit": unit.id, "pillar": pillar} for finding in findings],
+            "invalid_findings": len(problems),
+            "total_duration": data["total_duration"],
+            "prompt_eval_count": data["prompt_eval_count"],
+            "reasoning_tokens": data.get("reasoning_tokens"),
+            "answer_tokens": data.get("answer_tokens"),
+            "cache_hit": data["cache_hit"],
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(review, jobs))
+
+
+def domain_report(code, prompts, results):
+    """Merged findings, counts and maturity for one domain."""
+    done = [result for result in results if result["domain"] == code]
+    findings = merge_findings([finding for result in done if result["status"] == "done"
+                               for finding in result["findings"]])
+    return {
+        "domain": prompts[code]["name"],
+        "report": f"{prompts[code]['name']}.md",
+        "pillars": list(prompts[code]["pillars"]),
+        "errors": [f'{result["unit"]} {result["pillar"]}: {result["error"]}'
+                   for result in done if result["status"] == "error"],
+        "counts": {severity: sum(finding["severity"] == severity for finding in findings) for severity in SEVERITIES},
+        "invalid_findings": sum(result.get("invalid_findings", 0) for result in done),
+        "maturity": maturity_status(findings),
+        "findings": findings,
+    }
+
+
+def render_domain(report):
+    lines = [f"# {report['domain'].title()} review", "", "## Maturity", "", "| Level | Status |", "|-------|--------|"]
+    lines += [f"| {level} | {status} |" for level, status in report["maturity"].items()]
+    lines += ["", "## Findings", ""]
+    if report["findings"]:
+        lines += ["| Severity | Maturity | Unit | Location | Finding | Recommendation | Pillars |",
+                  "|----------|----------|------|----------|---------|----------------|---------|"]
+        lines += [f'| {f["severity"]} | {f["maturity"]} | {f["unit"]} | {f["location"]} | {f["title"]} '
+                  f'| {f["recommendation"]} | {", ".join(f["pillars"])} |' for f in report["findings"]]
+    else:
+        lines.append("No findings.")
+    if report["errors"]:
+        lines += ["", "## Errors", ""] + [f"- {error}" for error in report["errors"]]
+    return "\n".join(lines) + "\n"
+
+
+def render_summary(summary):
+    lines = [f"# Code review {summary['name']}", "",
+             f"Target `{summary['target']}` at `{summary['commit'] or 'no commit'}`, model `{summary['model']}`.", "",
+             "| Domain | HIGH | MEDIUM | LOW | " + " | ".join(MATURITY_LEVELS) + " |",
+             "|--------|------|--------|-----|" + "|".join("----" for _ in MATURITY_LEVELS) + "|"]
+    for code, report in summary["domains"].items():
+        counts = report["counts"]
+        lines.append(f"| [{code}]({report['report']}) | {counts['HIGH']} | {counts['MEDIUM']} | {counts['LOW']} | "
+                     + " | ".join(report["maturity"][level] for level in MATURITY_LEVELS) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run every review domain and pillar locally with Ollama.")
+    parser.add_argument("path", help="file or directory to review")
+    parser.add_argument("--domains", default=",".join(DOMAINS), help="comma separated subset of ARC,SRE,SEC,DAT")
+    parser.add_argument("--prompts-dir", default=DEFAULT_PROMPTS_DIR, help="directory holding <domain>/*.md prompts")
+    parser.add_argument("--name", help="batch name (defaults to git tag, branch-hash or date-hash)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="reports are written to <output-dir>/<name>/")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help="Ollama /api/chat endpoint; separate several with commas to spread requests over them")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Ollama model tag")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=3600, help="deadline in seconds for each reply")
+    parser.add_argument("--retries", type=int, default=3, help="retries for refused connections and 5xx responses")
+    parser.add_argument("--structured", action="store_true",
+                        help="have the model return findings as schema-checked JSON instead of FINDING lines")
+    add_client_args(parser)
+    add_store_args(parser)
+    parser.set_defaults(keep_alive="30m")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    domains = [code.strip().upper() for code in args.domains.split(",") if code.strip()]
+    unknown = [code for code in domains if code not in DOMAINS]
+    if unknown:
+        print(f"unknown domains {', '.join(unknown)}; choose from {', '.join(DOMAINS)}", file=sys.stderr)
+        return 2
+    try:
+        prompts = load_prompts(args.prompts_dir, [code for code in DOMAINS if code in domains])
+    except FileNotFoundError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+    target = os.path.abspath(args.path)
+    units = collect_units(target)
+    if not units:
+        print(f"nothing to review under {args.path}", file=sys.stderr)
+        return 1
+    name = args.name or batch_name(repository_dir(target))
+    output_dir = os.path.join(args.output_dir, name)
+    pillars = sum(len(domain["pillars"]) for domain in prompts.values())
+    print(f"{name}: {len(units)} units x {pillars} pillars -> {output_dir}")
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    started = time.monotonic()
+    session = make_session(args.concurrency, args.retries, hosts=len(endpoint_urls(args.url)))
+    client = client_from_args(args, session=session, timeout=args.timeout,
+                              format=FINDING_SCHEMA if args.structured else None)
+    try:
+        results = run_domains(units, prompts, client, concurrency=args.concurrency, structured=args.structured)
+    finally:
+        session.close()
+        client.telemetry.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {
+        "name": name,
+        "target": target,
+        "commit": git(repository_dir(target), "rev-parse", "HEAD"),
+        "model": args.model,
+        "started_at": started_at,
+        "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "units": len(units),
+        "requests": len(results),
+        "errors": sum(result["status"] == "error" for result in results),
+        "domains": {code: domain_report(code, prompts, results) for code in prompts},
+    }
+    for report in summary["domains"].values():
+        with open(os.path.join(output_dir, report["report"]), "w", encoding="utf-8") as file:
+            file.write(render_domain(report))
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+    with open(os.path.join(output_dir, "summary.md"), "w", encoding="utf-8") as file:
+        file.write(render_summary(summary))
+    store = store_from_args(args)
+    if store:
+        recorded = record_summary(store, summary)
+        store.close()
+        print(f"recorded {recorded} findings for {name} in {store.path}")
+    print(f"{len(results)} reviews in {time.monotonic() - started:.1f}s, {summary['errors']} errors; "
+          f"summary in {os.path.join(output_dir, 'summary.md')}")
+    return 0 if not summary["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
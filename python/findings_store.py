@@ -0,0 +1,311 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+DEFAULT_STORE_PATH = ".code-review/findings.db"
+# Domain recorded for findings from batch_review.py, which reviews code without the ARC/SRE/SEC/DAT split.
+BATCH_DOMAIN = "CODE"
+SEVERITIES = ("HIGH", "MEDIUM", "LOW")
+MATURITY_ORDER = ("pass", "partial", "fail", "locked")
+_SEVERITY_RANK = "case f.severity when 'HIGH' then 0 when 'MEDIUM' then 1 else 2 end"
+
+_SCHEMA = """
+create table if not exists releases (
+    id integer primary key,
+    name text not null unique,
+    commit_sha text,
+    recorded_at text not null default (datetime('now'))
+);
+create table if not exists findings (
+    id integer primary key,
+    release_id integer not null references releases (id) on delete cascade,
+    domain text not null,
+    pillars text not null,
+    severity text not null,
+    file text not null,
+    unit text not null,
+    location text,
+    rule text not null,
+    maturity text,
+    recommendation text,
+    fingerprint text not null
+);
+create table if not exists finding_pillars (
+    finding_id integer not null references findings (id) on delete cascade,
+    pillar text not null
+);
+create table if not exists maturity (
+    release_id integer not null references releases (id) on delete cascade,
+    domain text not null,
+    level text not null,
+    status text not null,
+    primary key (release_id, domain, level)
+);
+create index if not exists findings_by_release on findings (release_id, domain, severity);
+create index if not exists findings_by_pillar on finding_pillars (pillar, finding_id);
+create index if not exists pillars_by_finding on finding_pillars (finding_id);
+create index if not exists findings_by_file on findings (file, release_id);
+create index if not exists findings_by_fingerprint on findings (fingerprint, release_id);
+"""
+
+
+def fingerprint(domain, file, rule):
+    """Identity of a finding across releases: line numbers move as code changes, so only the rule's words count."""
+    words = " ".join(re.findall(r"\w+", rule.lower()))
+    return hashlib.sha256(f"{domain}\0{file}\0{words}".encode("utf-8")).hexdigest()[:16]
+
+
+class FindingsStore:
+    """SQLite store of every release's findings and maturity, indexed by release, domain, pillar, severity and file.
+
+    Releases are ordered by when they were first recorded; recording a release again replaces the domains given.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._db:
+            self._db.execute("pragma foreign_keys = on")
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def record(self, release, domain, findings, commit=None, maturity=None):
+        """Store one domain's findings for release, replacing what an earlier run recorded for it.
+
+        Each finding needs severity, unit (file or file#cte), rule or title, and optionally pillar, location,
+        maturity and recommendation. maturity is {level: status} for the domain.
+        """
+        with self._lock, self._db:
+            self._db.execute("insert into releases (name, commit_sha) values (?, ?) "
+                             "on conflict (name) do update set commit_sha = coalesce(excluded.commit_sha, commit_sha)",
+                             (release, commit))
+            release_id = self._db.execute("select id from releases where name = ?", (release,)).fetchone()[0]
+            self._db.execute("delete from findings where release_id = ? and domain = ?", (release_id, domain))
+            for finding in findings:
+                unit = finding["unit"]
+                file = unit.split("#", 1)[0]
+                rule = finding.get("rule") or finding["title"]
+                pillars = finding.get("pillars") or [finding.get("pillar") or ""]
+                finding_id = self._db.execute(
+                    "insert into findings (release_id, domain, pillars, severity, file, unit, location, rule, maturity, "
+                    "recommendation, fingerprint) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (release_id, domain, ", ".join(pillars), finding["severity"], file, unit, finding.get("location"),
+                     rule, finding.get("maturity"), finding.get("recommendation"), fingerprint(domain, file, rule)),
+                ).lastrowid
+                self._db.executemany("insert into finding_pillars values (?, ?)",
+                                     [(finding_id, pillar) for pillar in pillars])
+            if maturity is not None:
+                self._db.execute("delete from maturity where release_id = ? and domain = ?", (release_id, domain))
+                self._db.executemany("insert into maturity values (?, ?, ?, ?)",
+                                     [(release_id, domain, level, status) for level, status in maturity.items()])
+        return len(findings)
+
+    def releases(self):
+        return [dict(row) for row in self._db.execute("select name, commit_sha, recorded_at from releases order by id")]
+
+    def trend(self, domain=None, pillar=None, severity=None, file=None, last=None):
+        """Finding counts per release, domain and severity, oldest release first; filters narrow what is counted."""
+        where, params = _filters(domain=domain, pillar=pillar, severity=severity, file=file, last=last)
+        rows = self._db.execute(
+            f"select r.name as release, f.domain, f.severity, count(*) as findings "
+            f"from releases r join findings f on f.release_id = r.id {where} "
+            f"group by r.id, f.domain, f.severity order by r.id, f.domain, {_SEVERITY_RANK}", params)
+        return [dict(row) for row in rows]
+
+    def maturity_trend(self, domain=None, last=None):
+        where, params = _filters(table="m", domain=domain, last=last)
+        rows = self._db.execute(
+            f"select r.name as release, m.domain, m.level, m.status "
+            f"from releases r join maturity m on m.release_id = r.id {where} order by r.id, m.domain, m.level", params)
+        return [dict(row) for row in rows]
+
+    def new_since(self, release=None, since=None, domain=None, severity=None):
+        """Findings in release (the latest by default) that since (the release before it) did not have."""
+        current, previous = self._pair(release, since)
+        where, params = _filters(domain=domain, severity=severity)
+        return [dict(row) for row in self._db.execute(
+            f"select f.domain, f.pillars, f.severity, f.unit, f.location, f.rule, f.recommendation from findings f "
+            f"{where + ' and' if where else 'where'} f.release_id = ? and not exists "
+            f"(select 1 from findings p where p.fingerprint = f.fingerprint and p.release_id = ?) "
+            f"order by f.domain, {_SEVERITY_RANK}, f.unit", [*params, current, previous or -1])]
+
+    def regressions(self, release=None, since=None):
+        """What got worse in release compared with since: maturity levels, finding severities and reopened findings.
+
+        A finding is reopened when an earlier release had it, since did not, and release has it again.
+        """
+        current, previous = self._pair(release, since)
+        if previous is None:
+            return {"maturity": [], "severity": [], "reopened": []}
+        maturity = [dict(row) for row in self._db.execute(
+            "select c.domain, c.level, p.status as before, c.status as after from maturity c "
+            "join maturity p on p.domain = c.domain and p.level = c.level and p.release_id = ? "
+            "where c.release_id = ? order by c.domain, c.level", (previous, current))
+            if MATURITY_ORDER.index(row["after"]) > MATURITY_ORDER.index(row["before"])]
+        # A finding raised more than once in a release counts at its highest severity.
+        severity = [{**dict(row), "before": SEVERITIES[row["before"]], "after": SEVERITIES[row["after"]]}
+                    for row in self._db.execute(
+            f"with worst as (select f.release_id, f.fingerprint, min(f.domain) as domain, min(f.unit) as unit, "
+            f"min(f.rule) as rule, min({_SEVERITY_RANK}) as rank from findings f where f.release_id in (?, ?) "
+            f"group by f.release_id, f.fingerprint) "
+            f"select c.domain, c.unit, c.rule, p.rank as before, c.rank as after from worst c "
+            f"join worst p on p.fingerprint = c.fingerprint and p.release_id = ? "
+            f"where c.release_id = ? and c.rank < p.rank order by c.domain, c.unit",
+            (previous, current, previous, current))]
+        reopened = [dict(row) for row in self._db.execute(
+            "select distinct c.domain, c.severity, c.unit, c.rule from findings c where c.release_id = ? "
+            "and not exists (select 1 from findings p where p.fingerprint = c.fingerprint and p.release_id = ?) "
+            "and exists (select 1 from findings e where e.fingerprint = c.fingerprint and e.release_id < ?) "
+            "order by c.domain, c.unit", (current, previous, previous))]
+        return {"maturity": maturity, "severity": severity, "reopened": reopened}
+
+    def _pair(self, release, since):
+        current = self._release_id(release)
+        if since is not None:
+            return current, self._release_id(since)
+        row = self._db.execute("select max(id) from releases where id < ?", (current,)).fetchone()
+        return current, row[0]
+
+    def _release_id(self, name):
+        if name is None:
+            row = self._db.execute("select max(id) from releases").fetchone()
+        else:
+            row = self._db.execute("select id from releases where name = ?", (name,)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError(f"no release {name} in the findings store" if name else "the findings store is empty")
+        return row[0]
+
+
+def _filters(table="f", pillar=None, last=None, **columns):
+    """A where clause (and its parameters) matching columns of table, a pillar and the last releases."""
+    clauses = [(f"{table}.{name} = ?", value) for name, value in columns.items() if value is not None]
+    if pillar is not None:
+        clauses.append((f"exists (select 1 from finding_pillars fp where fp.finding_id = {table}.id "
+                        "and fp.pillar = ?)", pillar))
+    if last:
+        clauses.append((f"{table}.release_id in (select id from releases order by id desc limit ?)", last))
+    if not clauses:
+        return "", []
+    return "where " + " and ".join(clause for clause, _ in clauses), [value for _, value in clauses]
+
+
+def add_store_args(parser):
+    parser.add_argument("--findings-db", help="SQLite store the findings are added to (default <output-dir>/findings.db)")
+    parser.add_argument("--no-findings-db", action="store_true", help="do not record findings in the store")
+
+
+def store_from_args(args):
+    if args.no_findings_db:
+        return None
+    return FindingsStore(args.findings_db or os.path.join(args.output_dir, "findings.db"))
+
+
+def record_batch(store, manifest):
+    """Store the structured findings of a batch_review.py manifest (batch.json) under BATCH_DOMAIN."""
+    findings = [{**finding, "unit": unit["id"]} for unit in manifest["units"] for finding in unit.get("findings", [])]
+    return store.record(manifest["name"], BATCH_DOMAIN, findings, commit=manifest.get("commit"))
+
+
+def record_summary(store, summary):
+    """Store every domain of a domain_review.py summary (summary.json)."""
+    return sum(store.record(summary["name"], code, report["findings"], commit=summary.get("commit"),
+                            maturity=report["maturity"])
+               for code, report in summary["domains"].items())
+
+
+def import_reports(store, paths):
+    """Backfill the store from earlier summary.json and batch.json files, oldest first."""
+    reports = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            reports.append(json.load(file))
+    for report in sorted(reports, key=lambda report: report.get("finished_at") or ""):
+        count = record_summary(store, report) if "domains" in report else record_batch(store, report)
+        print(f"{report['name']}: {count} findings")
+
+
+def print_table(rows):
+    if not rows:
+        print("nothing found")
+        return
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query review findings across releases.")
+    parser.add_argument("--db", default=DEFAULT_STORE_PATH, help="SQLite findings store")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend = commands.add_parser("trend", help="finding counts (or maturity) per release")
+    trend.add_argument("--domain")
+    trend.add_argument("--pillar")
+    trend.add_argument("--severity", choices=SEVERITIES)
+    trend.add_argument("--file", help="path relative to the reviewed directory")
+    trend.add_argument("--last", type=int, help="only the most recent releases")
+    trend.add_argument("--maturity", action="store_true", help="show maturity status per level instead of counts")
+    new = commands.add_parser("new", help="findings new in a release")
+    new.add_argument("--release", help="defaults to the latest")
+    new.add_argument("--since", help="defaults to the release before it")
+    new.add_argument("--domain")
+    new.add_argument("--severity", choices=SEVERITIES)
+    regressions = commands.add_parser("regressions", help="maturity, severity and reopened findings that got worse")
+    regressions.add_argument("--release", help="defaults to the latest")
+    regressions.add_argument("--since", help="defaults to the release before it")
+    commands.add_parser("releases", help="list recorded releases")
+    backfill = commands.add_parser("import", help="record earlier summary.json or batch.json files")
+    backfill.add_argument("paths", nargs="+")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    store = FindingsStore(args.db)
+    try:
+        if args.command == "import":
+            import_reports(store, args.paths)
+            return 0
+        if args.command == "trend" and args.maturity:
+            result = store.maturity_trend(domain=args.domain, last=args.last)
+        elif args.command == "trend":
+            result = store.trend(domain=args.domain, pillar=args.pillar, severity=args.severity, file=args.file,
+                                 last=args.last)
+        elif args.command == "new":
+            result = store.new_since(args.release, args.since, domain=args.domain, severity=args.severity)
+        elif args.command == "regressions":
+            result = store.regressions(args.release, args.since)
+        else:
+            result = store.releases()
+    except KeyError as error:
+        print(error.args[0], file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif isinstance(result, dict):
+        for section, rows in result.items():
+            print(f"{section}:")
+            print_table(rows)
+            print()
+    else:
+        print_table(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
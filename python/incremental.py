@@ -0,0 +1,96 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+WHOLE_FILE = (1, float("inf"))
+
+
+def unit_sha(unit):
+    return hashlib.sha256(unit.text.encode("utf-8")).hexdigest()
+
+
+def previous_manifest(output_root, name=None):
+    """The most recently finished batch under output_root (or the one called name) that recorded a commit."""
+    candidates = []
+    for path in glob.glob(os.path.join(output_root, "*", "batch.json")):
+        with open(path, encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("commit") and (name is None or manifest["name"] == name):
+            manifest["directory"] = os.path.dirname(path)
+            candidates.append(manifest)
+    return max(candidates, key=lambda manifest: manifest["finished_at"], default=None)
+
+
+def changed_lines(base, commit):
+    """Lines changed since commit per file (paths relative to base), or None when git cannot diff against it.
+
+    Added and untracked files count as changed throughout; a pure deletion marks the line it happened at.
+    """
+    diff = subprocess.run(["git", "diff", "--relative", "--unified=0", "--no-color", commit, "--", "."],
+                          cwd=base, capture_output=True, text=True)
+    if diff.returncode != 0:
+        return None
+    changes = {}
+    for section in re.split(r"^diff --git ", diff.stdout, flags=re.MULTILINE)[1:]:
+        target = re.search(r"^\+\+\+ (?:b/)?(.+)$", section, re.MULTILINE)
+        if not target or target.group(1) == "/dev/null":
+            continue
+        path = target.group(1)
+        if re.search(r"^new file mode", section, re.MULTILINE):
+            changes[path] = [WHOLE_FILE]
+            continue
+        ranges = changes.setdefault(path, [])
+        for start, count in _HUNK.findall(section):
+            start, count = int(start), int(count or 1)
+            ranges.append((start, start + max(count, 1) - 1))
+
+    untracked = subprocess.run(["git", "ls-files", "--others", "--exclude-standard"],
+                               cwd=base, capture_output=True, text=True)
+    for path in untracked.stdout.splitlines():
+        changes[path] = [WHOLE_FILE]
+    return changes
+
+
+def plan_incremental(units, base, previous):
+    """Split units into those to review again and results carried forward from the previous batch.
+
+    A unit is re-reviewed when it is new, failed last time, overlaps a changed hunk, or its text differs
+    from what was reviewed (the last check also covers history git can no longer diff against).
+    """
+    previous_units = {unit["id"]: unit for unit in previous["units"]}
+    changes = changed_lines(base, previous["commit"])
+    to_review = []
+    carried = {}
+    for unit in units:
+        old = previous_units.get(unit.id)
+        if not old or old.get("status") != "done":
+            to_review.append(unit)
+            continue
+        touched = old.get("sha") != unit_sha(unit)
+        if changes is not None:
+            touched = touched or any(start <= unit.end_line and unit.start_line <= end
+                                     for start, end in changes.get(unit.path, []))
+        if touched:
+            to_review.append(unit)
+        else:
+            carried[unit.id] = {key: value for key, value in old.items()
+                                if key not in ("id", "path", "name", "start_line", "end_line", "sha")}
+            carried[unit.id]["carried_from"] = old.get("carried_from", previous["name"])
+    return to_review, carried
+
+
+def carry_forward(carried, previous, output_dir):
+    """Copy carried-forward unit reports into the new batch directory."""
+    if os.path.abspath(previous["directory"]) == os.path.abspath(output_dir):
+        return
+    for result in carried.values():
+        source = os.path.join(previous["directory"], result["result_file"])
+        destination = os.path.join(output_dir, result["result_file"])
+        if os.path.exists(source):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(source, destination)
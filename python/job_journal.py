@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+
+from incremental import unit_sha
+
+
+class JobJournal:
+    """Append-only log of unit states (pending, in_flight, done, error); the last line per unit wins.
+
+    Each line is flushed and fsynced before the work it describes starts or is reported, so after a crash or
+    container restart at most the units in flight are lost. A torn final line from a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, unit_id, entry):
+        line = json.dumps({"id": unit_id, **entry}) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def latest(self):
+        states = {}
+        if not os.path.exists(self.path):
+            return states
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                states[entry["id"]] = entry
+        return states
+
+    def reset(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def resume_plan(units, journal, output_dir):
+    """Split units into those still to review and results finished by an earlier, interrupted run.
+
+    A unit counts as finished only when it was done, its text is unchanged and its report is still on disk.
+    """
+    states = journal.latest()
+    to_review = []
+    finished = {}
+    for unit in units:
+        entry = states.get(unit.id)
+        if (entry and entry["status"] == "done" and entry.get("sha") == unit_sha(unit)
+                and os.path.exists(os.path.join(output_dir, entry["result_file"]))):
+            finished[unit.id] = {key: value for key, value in entry.items() if key not in ("id", "sha", "attempt")}
+        else:
+            to_review.append(unit)
+    return to_review, finished
@@ -0,0 +1,98 @@
+import hashlib
+import re
+
+from sql_lint import tokenize
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+BANDS = 16
+DEFAULT_THRESHOLD = 0.85
+
+_MERSENNE = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE)
+    for i in range(NUM_PERMUTATIONS)
+]
+_CODE_TOKEN = re.compile(r"\w+|[^\w\s]")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def normalized_tokens(text, sql=True):
+    """Tokens with case, layout, comments and literal values removed, so reformatted copies look the same."""
+    if not sql:
+        return [token.lower() for token in _CODE_TOKEN.findall(text)]
+    return ["?" if token.kind in ("string", "number") else token.text.lower() for token in tokenize(text)]
+
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    if len(tokens) <= size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+              for shingle in shingle_set]
+    return [min(((a * value + b) % _MERSENNE for value in hashes), default=_MERSENNE) for a, b in _PERMUTATIONS]
+
+
+def jaccard(left, right):
+    return len(left & right) / len(left | right) if left or right else 1.0
+
+
+def group_near_duplicates(units, threshold=DEFAULT_THRESHOLD):
+    """{member id: (representative id, similarity)} for units whose shingles overlap at least threshold.
+
+    MinHash signatures split into bands find candidate pairs without comparing every unit with every other;
+    candidates are then confirmed with the exact Jaccard similarity against the group's representative, the
+    first unit in the given order not already in a group. Only units of the same language are compared.
+    """
+    shingle_sets = [shingles(normalized_tokens(unit.text, unit.path.lower().endswith(".sql"))) for unit in units]
+    rows = NUM_PERMUTATIONS // BANDS
+    buckets = {}
+    for index, (unit, shingle_set) in enumerate(zip(units, shingle_sets)):
+        signature = minhash(shingle_set)
+        language = unit.path.rsplit(".", 1)[-1].lower()
+        for band in range(BANDS):
+            key = (language, band, tuple(signature[band * rows:(band + 1) * rows]))
+            buckets.setdefault(key, []).append(index)
+
+    candidates = {}
+    for members in buckets.values():
+        for position, left in enumerate(members):
+            for right in members[position + 1:]:
+                candidates.setdefault(left, set()).add(right)
+
+    # Every member must be similar to its representative itself, not just to another member of the group.
+    duplicates = {}
+    for index, unit in enumerate(units):
+        if unit.id in duplicates:
+            continue
+        for candidate in sorted(candidates.get(index, ())):
+            if units[candidate].id in duplicates:
+                continue
+            similarity = jaccard(shingle_sets[index], shingle_sets[candidate])
+            if similarity >= threshold:
+                duplicates[units[candidate].id] = (unit.id, round(similarity, 2))
+    return duplicates
+
+
+def member_findings(findings, representative, member):
+    """The representative's findings as they apply to member, each tagged with the unit they were copied from.
+
+    Line numbers in a location that fall inside the representative are moved by the offset between the units.
+    """
+    offset = member.start_line - representative.start_line
+
+    def shift(match):
+        line = int(match.group())
+        return str(line + offset) if representative.start_line <= line <= representative.end_line else match.group()
+
+    copied = []
+    for finding in findings:
+        finding = {**finding, "duplicate_of": representative.id}
+        if finding.get("location"):
+            finding["location"] = _NUMBER.sub(shift, finding["location"])
+        copied.append(finding)
+    return copied
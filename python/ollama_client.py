@@ -0,0 +1,170 @@
+import json
+import re
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_URL = "http://ollama-service:11434/api/chat"
+
+# Rough average for code; close enough for budgeting without shipping a tokenizer.
+CHARS_PER_TOKEN = 3.5
+# The context window Ollama uses when a request does not set num_ctx.
+DEFAULT_NUM_CTX = 2048
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OllamaError(Exception):
+    pass
+
+
+def make_session(concurrency=1, retries=3, hosts=1):
+    """A pooled session retrying refused connections and overloaded-server responses with backoff.
+
+    Read errors (including timeouts) are not retried here: a reply that blew its deadline is retried by the
+    caller, which knows how long it can wait.
+    """
+    retry = Retry(
+        total=retries,
+        read=0,
+        backoff_factor=2,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=concurrency, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def chat(payload, url=DEFAULT_URL, session=None, timeout=None):
+    http = session or requests
+    response = http.post(url, json={**payload, "stream": False}, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        raise OllamaError(data["error"])
+    data["retries"] = retry_count(response)
+    return data
+
+
+def stream_chat(payload, url=DEFAULT_URL, on_token=None, session=None, timeout=None):
+    """Read Ollama's NDJSON chunks as they arrive, calling on_token for each piece of content.
+
+    Returns the final chunk (total_duration, eval_count, ...) with the full message
+    reassembled, plus client-side time_to_first_token and inter_token_latency in ns.
+    timeout bounds the whole reply, not just the wait between chunks.
+
+    If on_token returns False the connection is closed, which makes Ollama stop generating, and
+    the reply so far is returned with done_reason "client_stop" and client-measured counts.
+    """
+    http = session or requests
+    started = time.perf_counter_ns()
+    deadline = None if timeout is None else started + timeout * 1e9
+    first_token_at = None
+    last_token_at = None
+    gaps = []
+    parts = []
+    role = "assistant"
+    final = None
+
+    with http.post(url, json={**payload, "stream": True}, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in ndjson_lines(response):
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise OllamaError(chunk["error"])
+            message = chunk.get("message") or {}
+            role = message.get("role", role)
+            token = message.get("content", "")
+            if token:
+                now = time.perf_counter_ns()
+                if first_token_at is None:
+                    first_token_at = now
+                else:
+                    gaps.append(now - last_token_at)
+                last_token_at = now
+                parts.append(token)
+                if on_token and on_token(token) is False:
+                    final = _stopped_chunk(payload, started, first_token_at, len(parts))
+                    break
+            if chunk.get("done"):
+                final = chunk
+                break
+            if deadline and time.perf_counter_ns() > deadline:
+                raise requests.Timeout(f"no complete reply within {timeout}s")
+
+    if final is None:
+        raise OllamaError("stream ended before the final chunk was received")
+
+    data = dict(final)
+    data["message"] = {"role": role, "content": "".join(parts)}
+    data["time_to_first_token"] = None if first_token_at is None else first_token_at - started
+    data["inter_token_latency"] = latency_summary(gaps)
+    data["retries"] = retry_count(response)
+    return data
+
+
+def _stopped_chunk(payload, started, first_token_at, tokens):
+    # Ollama only reports its counters in the final chunk, so these are measured or estimated here.
+    now = time.perf_counter_ns()
+    return {
+        "model": payload["model"],
+        "done": True,
+        "done_reason": "client_stop",
+        "total_duration": now - started,
+        "load_duration": 0,
+        "prompt_eval_count": sum(estimate_tokens(message["content"]) for message in payload["messages"]),
+        "prompt_eval_duration": first_token_at - started,
+        "eval_count": tokens,
+        "eval_duration": now - first_token_at,
+    }
+
+
+def retry_count(response):
+    """How many times urllib3 retried before this response (0 without a retrying adapter)."""
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def strip_reasoning(content):
+    """Drop DeepSeek-R1 style <think> blocks, leaving only the answer; a block cut off unclosed is dropped too."""
+    return re.sub(r"<think>.*?(?:</think>|$)", "", content, flags=re.DOTALL).strip()
+
+
+def estimate_tokens(text):
+    return round(len(text) / CHARS_PER_TOKEN)
+
+
+def ndjson_lines(response):
+    # requests' iter_lines holds back the last line until more data arrives, which delays every token by one chunk.
+    buffer = b""
+    for data in response.iter_content(chunk_size=None):
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+def latency_summary(samples):
+    if not samples:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) // len(ordered),
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "max": ordered[-1],
+    }
+
+
+def percentile(ordered, pct):
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,284 @@
+import argparse
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ollama_client import estimate_tokens
+
+# Simulated hardware per model size: (generated tokens/sec, prompt tokens/sec, cold load seconds).
+MODEL_PROFILES = {
+    "1.5b": (150.0, 3000.0, 2.0),
+    "14b": (25.0, 600.0, 8.0),
+    "32b": (12.0, 300.0, 15.0),
+    "70b": (6.0, 150.0, 30.0),
+    "671b": (1.0, 20.0, 300.0),
+}
+DEFAULT_PROFILE = (20.0, 500.0, 5.0)
+# Embedding models answer /api/embed (and are never loaded as the chat model).
+EMBED_MODELS = ("nomic-embed-text",)
+EMBED_DIMENSIONS = 64
+
+
+def model_profile(model):
+    return MODEL_PROFILES.get(model.rsplit(":", 1)[-1], DEFAULT_PROFILE)
+
+
+class StubOllama(ThreadingHTTPServer):
+    """A deterministic stand-in for an Ollama server with token timing simulated from MODEL_PROFILES.
+
+    The same prompt always yields the same reply. One model is resident at a time, so
+    switching models pays its load time, and the longest prompt prefix shared with the
+    previous request is served from a simulated KV cache. time_scale shrinks how long
+    the stub actually waits, while the reported *_duration fields stay at simulated
+    hardware speed so tokens/sec reads like the real model.
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), time_scale=0.01, parallel=4, models=None):
+        super().__init__(address, _StubHandler)
+        self.time_scale = time_scale
+        self.models = list(models or [f"deepseek-r1:{size}" for size in MODEL_PROFILES])
+        self.loaded_model = None
+        self.previous_prompt = {}
+        self.state_lock = threading.Lock()
+        self.slots = threading.Semaphore(parallel)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self):
+        return f"{self.base_url}/api/chat"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping a kept-alive connection are routine, not worth a traceback.
+        pass
+
+    def plan_reply(self, payload):
+        """Work out the reply tokens and the simulated durations (in seconds) for a request."""
+        model = payload["model"]
+        prompt = "\n".join(message["content"] for message in payload["messages"])
+        eval_rate, prompt_rate, load_seconds = model_profile(model)
+        with self.state_lock:
+            load = load_seconds if self.loaded_model != model else 0.0
+            self.loaded_model = model
+            shared = _common_prefix_length(self.previous_prompt.get(model, ""), prompt)
+            self.previous_prompt[model] = prompt
+        prompt_tokens = max(1, estimate_tokens(prompt) - estimate_tokens(prompt[:shared]))
+        prefilled = payload["messages"][-1]["role"] == "assistant"
+        options = payload.get("options", {})
+        tokens = _reply_tokens(prompt, options.get("num_predict"), prefilled, payload.get("format"))
+        tokens = _until_stop(tokens, options.get("stop", []))
+        return {
+            "tokens": tokens,
+            "load": load,
+            "prompt_tokens": prompt_tokens,
+            "prompt_eval": prompt_tokens / prompt_rate,
+            "per_token": 1 / eval_rate,
+        }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": model, "model": model} for model in server.models]})
+        elif self.path == "/api/ps":
+            loaded = [server.loaded_model] if server.loaded_model else []
+            self._send_json({"models": [{"name": model, "model": model} for model in loaded]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/embed"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/api/embed":
+            self._embed(payload)
+            return
+        if payload.get("model") not in self.server.models:
+            self._send_json({"error": f"model '{payload.get('model')}' not found"}, status=404)
+            return
+
+        scale = self.server.time_scale
+        with self.server.slots:
+            plan = self.server.plan_reply(payload)
+            time.sleep((plan["load"] + plan["prompt_eval"]) * scale)
+            if payload.get("stream", True):
+                self._start_chunked()
+                for token in plan["tokens"]:
+                    time.sleep(plan["per_token"] * scale)
+                    self._write_chunk(_line({"model": payload["model"], "created_at": _now(),
+                                             "message": {"role": "assistant", "content": token}, "done": False}))
+                self._write_chunk(_line(self._final(payload, plan, "")))
+                self._end_chunked()
+            else:
+                time.sleep(plan["per_token"] * len(plan["tokens"]) * scale)
+                self._send_json(self._final(payload, plan, "".join(plan["tokens"])))
+
+    def _embed(self, payload):
+        if payload.get("model") not in EMBED_MODELS:
+            self._send_json({"error": f"model '{payload.get('model')}' not found"}, status=404)
+            return
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        self._send_json({"model": payload["model"], "embeddings": [_embedding(text) for text in texts],
+                         "prompt_eval_count": sum(estimate_tokens(text) for text in texts)})
+
+    def _final(self, payload, plan, content):
+        eval_seconds = plan["per_token"] * len(plan["tokens"])
+        return {
+            "model": payload["model"],
+            "created_at": _now(),
+            "message": {"role": "assistant", "content": content},
+            "done_reason": "length" if payload.get("options", {}).get("num_predict") == len(plan["tokens"]) else "stop",
+            "done": True,
+            "total_duration": round((plan["load"] + plan["prompt_eval"] + eval_seconds) * 1e9),
+            "load_duration": round(plan["load"] * 1e9),
+            "prompt_eval_count": plan["prompt_tokens"],
+            "prompt_eval_duration": round(plan["prompt_eval"] * 1e9),
+            "eval_count": len(plan["tokens"]),
+            "eval_duration": round(eval_seconds * 1e9),
+        }
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _reply_tokens(prompt, num_predict=None, prefilled=False, schema=None):
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    if isinstance(schema, dict):
+        tokens = _structured_tokens(seed, schema)
+        return tokens[:num_predict] if num_predict else tokens
+    reasoning = ["<think>\n"] + [f"step {index} " for index in range(16 + seed % 32)] + ["\n</think>\n\n"]
+    answer = ["## Findings\n"] + [f"- finding {index}: line {1 + (seed >> index) % 40}\n" for index in range(4 + seed % 8)]
+    if "TRIAGE: severity=" in prompt:
+        answer.append(f"TRIAGE: severity={('none', 'low', 'medium', 'high')[seed % 4]} confidence={40 + seed % 60}\n")
+    if "FINDING: severity=" in prompt:
+        titles = ("Missing index on join key", "Unbounded query without limit", "Hard-coded credentials",
+                  "No retry on transient failure", "Column names not documented")
+        answer += [f"FINDING: severity={('HIGH', 'MEDIUM', 'LOW')[(seed >> index) % 3]} | "
+                   f"maturity={('HYG', 'L1', 'L2', 'L3')[(seed >> (index + 2)) % 4]} | "
+                   f"location=line {1 + (seed >> index) % 5} | title={titles[(seed >> (index + 4)) % len(titles)]} | "
+                   f"recommendation=Fix it.\n" for index in range(1 + seed % 3)]
+    if "END OF REVIEW" in prompt:
+        # Like real models, carry on for a while after the requested end marker.
+        answer += ["END OF REVIEW\n"] + [f"afterthought {index} " for index in range(8 + seed % 16)]
+    # An assistant prefill is continued from where it stops, which here means the reasoning is already done.
+    tokens = answer if prefilled else reasoning + answer
+    return tokens[:num_predict] if num_predict else tokens
+
+
+def _until_stop(tokens, stops):
+    # Like Ollama, end the reply at the first stop sequence without sending the sequence itself.
+    text = ""
+    for index, token in enumerate(tokens):
+        text += token
+        found = [text.find(stop) for stop in stops if stop in text]
+        if found:
+            cut = min(found) - (len(text) - len(token))
+            return tokens[:index] + ([token[:cut]] if cut > 0 else [])
+    return tokens
+
+
+def _structured_tokens(seed, schema):
+    # A constrained reply has no reasoning, just JSON following the schema's finding properties.
+    properties = schema["properties"]["findings"]["items"]["properties"]
+    findings = []
+    for index in range(seed % 4):
+        finding = {}
+        for name, rule in properties.items():
+            if "enum" in rule:
+                finding[name] = rule["enum"][(seed >> (index + len(finding))) % len(rule["enum"])]
+            elif name == "location":
+                finding[name] = f"line {1 + (seed >> index) % 40}"
+            else:
+                finding[name] = f"{name} {index}"
+        findings.append(finding)
+    text = json.dumps({"findings": findings})
+    return [text[index:index + 4] for index in range(0, len(text), 4)]
+
+
+def _embedding(text):
+    # Hashed bag of words: texts sharing identifiers get similar vectors, which is all the index needs to rank.
+    vector = [0.0] * EMBED_DIMENSIONS
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % EMBED_DIMENSIONS] += 1.0
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+
+def _common_prefix_length(left, right):
+    length = min(len(left), len(right))
+    for index in range(length):
+        if left[index] != right[index]:
+            return index
+    return length
+
+
+def _line(data):
+    return (json.dumps(data) + "\n").encode("utf-8")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a deterministic stand-in for the Ollama /api/chat endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiply every simulated duration by this")
+    parser.add_argument("--parallel", type=int, default=4, help="requests served at once")
+    args = parser.parse_args(argv)
+    server = StubOllama((args.host, args.port), time_scale=args.time_scale, parallel=args.parallel)
+    print(f"stub Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
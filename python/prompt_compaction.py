@@ -0,0 +1,74 @@
+import threading
+from dataclasses import dataclass, field
+
+from ollama_client import estimate_tokens
+from sql_lint import scan
+
+NUMBERED_NOTE = ("The code is compacted and each line starts with its line number in the original file; "
+                 "cite those numbers.")
+
+_NO_SPACE_BEFORE = {")", ",", ".", ";"}
+_NO_SPACE_AFTER = {"(", "."}
+
+
+@dataclass
+class Compacted:
+    text: str
+    original_tokens: int
+    tokens: int
+
+
+@dataclass
+class Compaction:
+    """Whitespace normalisation for SQL sent to the model; comments are kept unless strip_comments is set.
+
+    Keeps a running estimate of the tokens of code seen and of what was sent, for reporting the savings.
+    """
+
+    strip_comments: bool = False
+    original_tokens: int = field(default=0, init=False)
+    tokens: int = field(default=0, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def apply(self, sql, line_numbers=None):
+        compacted = compact_sql(sql, line_numbers, strip_comments=self.strip_comments)
+        with self._lock:
+            self.original_tokens += compacted.original_tokens
+            self.tokens += compacted.tokens
+        return compacted
+
+    def summary(self):
+        # Line-number prefixes can outweigh the whitespace removed from code that was already compact.
+        change = self.tokens / self.original_tokens - 1 if self.original_tokens else 0
+        return f"compaction: ~{self.original_tokens} tokens of code sent as ~{self.tokens} ({change:+.0%})"
+
+
+def compact_sql(sql, line_numbers=None, strip_comments=False):
+    """Collapse indentation and runs of spaces, join lines split inside brackets, and number what is left.
+
+    line_numbers gives the original line of each line of sql (1, 2, ... when omitted); every compacted line is
+    prefixed with the original line it starts on, so findings can cite the file as written. String literals
+    and quoted names are kept verbatim.
+    """
+    numbers = line_numbers or list(range(1, sql.count("\n") + 2))
+    lines = []
+    spaced = broken = closed = False
+    for token in scan(sql):
+        if token.kind == "space" or (token.kind == "comment" and strip_comments):
+            spaced = True
+            broken = broken or "\n" in token.text
+            continue
+        text = " ".join(token.text.split()) if token.kind == "comment" else token.text
+        previous = lines[-1][1][-1] if lines else None
+        if not lines or closed or (broken and previous != "(" and text != ")"):
+            lines.append((numbers[token.line - 1], [text]))
+        else:
+            if spaced and previous not in _NO_SPACE_AFTER and text not in _NO_SPACE_BEFORE:
+                lines[-1][1].append(" ")
+            lines[-1][1].append(text)
+        spaced = broken = False
+        closed = token.kind == "comment" and text.startswith("--")
+
+    rendered = ["".join(parts) if number is None else f"{number}|{''.join(parts)}" for number, parts in lines]
+    text = "\n".join(rendered)
+    return Compacted(text, estimate_tokens(sql), estimate_tokens(text))
@@ -0,0 +1,80 @@
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+END_MARKER = "END OF REVIEW"
+END_INSTRUCTION = f"Finish the review with a line reading {END_MARKER}."
+# Appended to truncated reasoning before it is handed back to the model to continue as the answer.
+STEER_NOTE = "\n\nThat is as far as I can think this through; time to write the review.\n"
+
+
+class ReasoningStream:
+    """Follows a streamed reply, telling <think> reasoning apart from the answer.
+
+    feed() takes each streamed piece of content (Ollama sends about one token per chunk) and returns
+    "reasoning_budget" once the reasoning has used budget tokens, meaning generation should stop, or None.
+    Tags split across chunks are caught by holding the start of the reply until it shows whether it opens
+    with <think>, then only the last few characters of the reasoning. Whitespace before the reply starts
+    counts as answer.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.reasoning = False
+        self.answering = False
+        self.reasoning_tokens = 0
+        self.answer_tokens = 0
+        self.stopped = None
+        self._pieces = []
+        # The reply's first non-blank characters, until they show whether it opens with <think>.
+        self._head = ""
+        self._undecided = 0
+        # The end of the reasoning so far, long enough to find a </think> split over several tokens.
+        self._tail = ""
+
+    @property
+    def text(self):
+        return "".join(self._pieces)
+
+    def feed(self, token):
+        self._pieces.append(token)
+        if self.reasoning:
+            self.reasoning_tokens += 1
+            self._follow_reasoning(token)
+        elif self.answering:
+            self.answer_tokens += 1
+        else:
+            self._start(token)
+        if self.reasoning and self.budget is not None and self.reasoning_tokens >= self.budget:
+            self.stopped = "reasoning_budget"
+        return self.stopped
+
+    def _start(self, token):
+        self._head = (self._head + token).lstrip()
+        if not self._head:
+            self.answer_tokens += 1
+            return
+        self._undecided += 1
+        if self._head.startswith(THINK_OPEN):
+            self.reasoning_tokens += self._undecided
+            self.reasoning = True
+            self._follow_reasoning(self._head[len(THINK_OPEN):])
+        elif not THINK_OPEN.startswith(self._head):
+            self.answer_tokens += self._undecided
+            self.answering = True
+
+    def _follow_reasoning(self, token):
+        self._tail += token
+        if THINK_CLOSE in self._tail:
+            self.reasoning = False
+            self.answering = True
+        else:
+            self._tail = self._tail[-(len(THINK_CLOSE) - 1):]
+
+    def steer(self, closing):
+        """Close the reasoning with closing (ending in </think>) so everything after it counts as the answer."""
+        self._pieces.append(closing)
+        self.reasoning = False
+        self.answering = True
+        self.stopped = None
+
+    def counts(self):
+        return {"reasoning_tokens": self.reasoning_tokens, "answer_tokens": self.answer_tokens}
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CACHE_DIR = ".code-review/cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Fields that change how a request is served but not what the model replies.
+_UNKEYED_FIELDS = ("stream", "keep_alive")
+
+
+def cache_key(payload):
+    keyed = {name: value for name, value in payload.items() if name not in _UNKEYED_FIELDS}
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ReviewCache:
+    """Content-addressed store of Ollama replies keyed by model, messages and options.
+
+    Entries are JSON files; reading one refreshes its mtime so eviction drops the
+    least recently used entries first once the directory grows past max_bytes. The
+    directory's size is read once and then kept as a running total, so it is only
+    scanned again when a put takes it past max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._bytes = None
+
+    def get(self, payload):
+        path = self._path(cache_key(payload))
+        if self.bypass or not os.path.exists(path):
+            self._count("misses")
+            return None
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return data
+
+    def put(self, payload, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(cache_key(payload))
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        size = os.path.getsize(temp_path)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._entries())
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+            self._bytes += size - replaced
+            full = self._bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self._bytes = total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
@@ -0,0 +1,225 @@
+import sys
+import threading
+import time
+
+from ollama_client import DEFAULT_NUM_CTX, DEFAULT_URL, OllamaError, chat, estimate_tokens, stream_chat
+from reasoning import END_MARKER, STEER_NOTE, THINK_CLOSE, ReasoningStream
+from scheduler import FAILOVER_ERRORS
+from telemetry import call_record
+
+DEFAULT_MODEL = "deepseek-r1:14b"
+# Room left in the context window for the reply, including the model's reasoning.
+DEFAULT_REPLY_TOKENS = 2048
+
+# Client-side timings that describe one particular call rather than the reply itself.
+_UNCACHED_FIELDS = ("time_to_first_token", "inter_token_latency", "retries", "endpoint")
+# Counters that add up when a steered reply is assembled from two requests.
+_SUMMED_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count",
+                  "eval_duration")
+
+
+class PrefixReuse:
+    """Estimates the model load and prompt evaluation each request avoided.
+
+    Ollama only reports the prompt tokens it actually evaluated, so tokens served from
+    its KV cache show up as the gap between the estimated prompt size and prompt_eval_count.
+    Load savings are measured against the slowest (cold) load seen for the model.
+    """
+
+    def __init__(self):
+        self._cold_load_duration = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, messages, data):
+        load_duration = data.get("load_duration", 0)
+        with self._lock:
+            cold = max(self._cold_load_duration.get(model, 0), load_duration)
+            self._cold_load_duration[model] = cold
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        prefix_tokens = sum(estimate_tokens(message["content"]) for message in messages[:-1])
+        evaluated = data.get("prompt_eval_count", 0)
+        # Only the shared prefix can come from the KV cache, which also bounds the estimate's error.
+        reused = min(prefix_tokens, max(0, prompt_tokens - evaluated))
+        per_token = data.get("prompt_eval_duration", 0) / evaluated if evaluated else 0
+        return {
+            "load_duration_saved": cold - load_duration,
+            "prompt_tokens_reused": reused,
+            "prompt_eval_saved": round(reused * per_token),
+        }
+
+
+class ReviewClient:
+    """Sends review messages to Ollama with shared transport settings, caching, reuse accounting and telemetry.
+
+    With a pool (scheduler.EndpointPool) requests are spread over its endpoints instead of going to url.
+
+    With a reasoning_budget (tokens) replies are streamed and the model's <think> block is cut off when it
+    runs out: on_budget "steer" hands the reasoning so far back as a prefilled answer that closes the block,
+    so the model writes its answer from there; "stop" returns the reply as it stands. With early_stop Ollama
+    is given END OF REVIEW as a stop sequence, so it ends the reply there and still sends its final counters.
+
+    format (a JSON schema, or "json") is passed to Ollama to constrain every reply.
+    """
+
+    def __init__(self, url=DEFAULT_URL, model=DEFAULT_MODEL, session=None, timeout=None, cache=None,
+                 num_ctx=None, keep_alive=None, options=None, telemetry=None, max_num_ctx=None,
+                 reply_tokens=DEFAULT_REPLY_TOKENS, pool=None, reasoning_budget=None, on_budget="steer",
+                 early_stop=False, format=None):
+        self.url = url
+        self.model = model
+        self.session = session
+        self.timeout = timeout
+        self.cache = cache
+        self.options = dict(options or {})
+        if num_ctx:
+            self.options["num_ctx"] = num_ctx
+        if early_stop:
+            self.options["stop"] = [*self.options.get("stop", []), END_MARKER]
+        self.keep_alive = keep_alive
+        self.telemetry = telemetry
+        self.max_num_ctx = max_num_ctx
+        self.reply_tokens = reply_tokens
+        self.pool = pool
+        self.reasoning_budget = reasoning_budget
+        self.on_budget = on_budget
+        self.early_stop = early_stop
+        self.format = format
+        self.reuse = PrefixReuse()
+
+    def payload(self, messages, model=None, options=None):
+        payload = {"model": model or self.model, "messages": messages}
+        options = {**self.fit_context(messages), **(options or {})}
+        if options:
+            payload["options"] = options
+        if self.format is not None:
+            payload["format"] = self.format
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def fit_context(self, messages):
+        """Options for messages, doubling num_ctx up to max_num_ctx when the prompt and reply would not fit.
+
+        Sizes stay powers of two so requests share a handful of context windows (each change reloads the model).
+        A prompt that is itself larger than the window is sent anyway with a warning, since Ollama would
+        truncate it silently.
+        """
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        needed = prompt_tokens + self.reply_tokens
+        num_ctx = self.options.get("num_ctx", DEFAULT_NUM_CTX)
+        if needed <= num_ctx:
+            return self.options
+        fitted = num_ctx
+        while fitted < needed and self.max_num_ctx and fitted * 2 <= self.max_num_ctx:
+            fitted *= 2
+        if fitted < prompt_tokens:
+            print(f"warning: prompt needs ~{prompt_tokens} tokens but num_ctx is {fitted}; "
+                  "the model will not see all of it (raise --max-num-ctx or review in chunks)", file=sys.stderr)
+        return {**self.options, "num_ctx": fitted} if fitted != num_ctx else self.options
+
+    def prompt_budget(self):
+        """Prompt tokens one request can carry once fit_context has raised num_ctx as far as max_num_ctx allows."""
+        num_ctx = self.options.get("num_ctx", DEFAULT_NUM_CTX)
+        while self.max_num_ctx and num_ctx * 2 <= self.max_num_ctx:
+            num_ctx *= 2
+        return num_ctx - self.reply_tokens
+
+    def send(self, messages, on_token=None, model=None, chunk_id=None, queue_wait=0, options=None):
+        """Review messages, streaming tokens to on_token when given; cached replies are replayed through it.
+
+        options override the client's Ollama options for this request only (e.g. num_predict).
+        chunk_id and queue_wait (ns spent waiting for a worker) are only used for telemetry.
+        """
+        payload = self.payload(messages, model, options)
+        started = time.perf_counter_ns()
+        try:
+            data = self._send(payload, on_token)
+        except Exception as error:
+            self._record(payload, None, started, queue_wait, chunk_id, error=str(error))
+            raise
+        self._record(payload, data, started, queue_wait, chunk_id)
+        return data
+
+    def _record(self, payload, data, started, queue_wait, chunk_id, error=None):
+        if self.telemetry:
+            endpoint = (data or {}).get("endpoint", self.url)
+            latency = time.perf_counter_ns() - started
+            self.telemetry.record(call_record(payload["model"], endpoint, data, latency=latency,
+                                              queue_wait=queue_wait, chunk_id=chunk_id, error=error))
+
+    def _send(self, payload, on_token):
+        messages = payload["messages"]
+        key = self._cache_key_payload(payload)
+        cached = self.cache.get(key) if self.cache else None
+        if cached:
+            cached["cache_hit"] = True
+            if on_token:
+                on_token(cached["message"]["content"])
+            return cached
+
+        if self.pool:
+            data = self.pool.send(payload["model"], lambda url: self._request(url, payload, on_token))
+        else:
+            data = self._request(self.url, payload, on_token)
+        if self.cache:
+            self.cache.put(key, {name: value for name, value in data.items() if name not in _UNCACHED_FIELDS})
+        data["cache_hit"] = False
+        data.update(self.reuse.record(payload["model"], messages, data))
+        return data
+
+    def _cache_key_payload(self, payload):
+        # A reasoning budget changes the reply without touching the payload, so budgeted replies are kept apart.
+        if self.reasoning_budget is None:
+            return payload
+        return {**payload, "reasoning_budget": self.reasoning_budget, "on_budget": self.on_budget}
+
+    def _request(self, url, payload, on_token):
+        # Early stop streams too, to catch a stop sequence the model quoted while still inside <think>.
+        watching = self.reasoning_budget is not None or self.early_stop
+        if not on_token and not watching:
+            return chat(payload, url=url, session=self.session, timeout=self.timeout)
+        emitted = False
+        stream = ReasoningStream(self.reasoning_budget)
+
+        def forward(token):
+            nonlocal emitted
+            emitted = emitted or on_token is not None
+            if on_token:
+                on_token(token)
+            return stream.feed(token) is None
+
+        try:
+            data = stream_chat(payload, url=url, on_token=forward, session=self.session, timeout=self.timeout)
+            out_of_budget = stream.stopped == "reasoning_budget" and self.on_budget == "steer"
+            stopped_thinking = self.early_stop and stream.reasoning and data.get("done_reason") == "stop"
+            if out_of_budget or stopped_thinking:
+                data = self._steer(url, payload, stream, data, forward, on_token)
+        except FAILOVER_ERRORS as error:
+            # Output already shown cannot be taken back, so a broken stream is not retried elsewhere.
+            if emitted:
+                raise OllamaError(f"{url} stopped mid-stream: {error}") from error
+            raise
+        data.update(stream.counts())
+        data["stopped"] = stream.stopped
+        return data
+
+    def _steer(self, url, payload, stream, data, forward, on_token):
+        """Continue a reply whose reasoning was cut short from an assistant prefill that closes <think>.
+
+        The prefill extends the prompt just sent, so Ollama reuses its KV cache instead of evaluating it again.
+        """
+        closing = f"{STEER_NOTE}{THINK_CLOSE}\n\n"
+        prefill = {"role": "assistant", "content": stream.text + closing}
+        stream.steer(closing)
+        if on_token:
+            on_token(closing)
+        answer = stream_chat({**payload, "messages": payload["messages"] + [prefill]}, url=url, on_token=forward,
+                             session=self.session, timeout=self.timeout)
+        steered = dict(answer)
+        for field in _SUMMED_FIELDS:
+            steered[field] = data.get(field, 0) + answer.get(field, 0)
+        steered["message"] = {"role": "assistant", "content": prefill["content"] + answer["message"]["content"]}
+        steered["time_to_first_token"] = data["time_to_first_token"]
+        steered["retries"] = data["retries"] + answer["retries"]
+        steered["steered"] = True
+        return steered
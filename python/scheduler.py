@@ -0,0 +1,161 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+import requests
+
+from ollama_client import OllamaError
+
+DEFAULT_HEALTH_INTERVAL = 30
+HEALTH_TIMEOUT = 5
+# Queued requests an endpoint with the model already loaded may carry before an idle one is asked to load it.
+DEFAULT_SWAP_PENALTY = 2
+FAILOVER_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class EndpointsUnavailable(OllamaError):
+    """Every endpoint that could serve the request is down or failed it; worth retrying after a wait."""
+
+
+@dataclass
+class Endpoint:
+    url: str
+    healthy: bool = True
+    installed: set = None
+    loaded: set = field(default_factory=set)
+    in_flight: int = 0
+    served: int = 0
+    failures: int = 0
+
+    @property
+    def base_url(self):
+        return self.url.rsplit("/api/", 1)[0]
+
+    def serves(self, model):
+        return self.installed is None or model in self.installed
+
+
+class EndpointPool:
+    """Spreads requests over several Ollama servers.
+
+    Each request goes to the healthy server with the model installed that has the fewest requests in flight,
+    counting servers without the model loaded as DEFAULT_SWAP_PENALTY requests busier so batches stick to warm
+    servers until they queue up. With a profile (deadline.RateProfile) that count is divided by each server's
+    measured tokens/sec for the model, so faster servers take proportionally more of the queue. Servers are
+    re-checked through /api/tags and /api/ps every health_interval seconds; one that refuses or drops a
+    connection is taken out of rotation until a check finds it answering again, and a request finding every
+    server out of rotation checks them again first. A reply that times out does not take its server out.
+    """
+
+    def __init__(self, urls, health_interval=DEFAULT_HEALTH_INTERVAL, swap_penalty=DEFAULT_SWAP_PENALTY,
+                 profile=None):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.swap_penalty = swap_penalty
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._checked_at = None
+
+    def refresh(self):
+        """Health-check every endpoint, recording which models each has installed and loaded."""
+        for endpoint in self.endpoints:
+            try:
+                tags = requests.get(f"{endpoint.base_url}/api/tags", timeout=HEALTH_TIMEOUT)
+                ps = requests.get(f"{endpoint.base_url}/api/ps", timeout=HEALTH_TIMEOUT)
+                tags.raise_for_status()
+                ps.raise_for_status()
+                installed = {model["name"] for model in tags.json().get("models", [])}
+                loaded = {model["name"] for model in ps.json().get("models", [])}
+            except (requests.RequestException, ValueError):
+                with self._lock:
+                    endpoint.healthy = False
+                continue
+            with self._lock:
+                endpoint.healthy = True
+                endpoint.installed = installed
+                endpoint.loaded = loaded
+        self._checked_at = time.monotonic()
+
+    def acquire(self, model, exclude=()):
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.health_interval:
+            if self._refreshing.acquire(blocking=self._checked_at is None):
+                try:
+                    self.refresh()
+                finally:
+                    self._refreshing.release()
+        endpoint = self._pick(model, exclude)
+        if endpoint is None:
+            # Every server that could take it is marked down; check again rather than fail the request.
+            self._refresh_since(time.monotonic())
+            endpoint = self._pick(model, exclude)
+        if endpoint is None:
+            if any(endpoint.serves(model) for endpoint in self.endpoints):
+                raise EndpointsUnavailable(f"no healthy endpoint serves {model}")
+            raise OllamaError(f"no endpoint has {model} installed")
+        return endpoint
+
+    def _pick(self, model, exclude):
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint.healthy and endpoint.serves(model) and endpoint.url not in exclude]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: self._expected_wait(e, model))
+            endpoint.in_flight += 1
+            endpoint.loaded.add(model)
+            return endpoint
+
+    def _refresh_since(self, asked_at):
+        # Workers that find every endpoint down together share one health check.
+        with self._refreshing:
+            if self._checked_at is None or self._checked_at < asked_at:
+                self.refresh()
+
+    def _expected_wait(self, endpoint, model):
+        queued = endpoint.in_flight + (0 if model in endpoint.loaded else self.swap_penalty)
+        if self.profile is None:
+            return queued
+        return (queued + 1) / self.profile.rates(model, endpoint.url).eval_rate
+
+    def release(self, endpoint, failed=False, unreachable=False):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if unreachable:
+                endpoint.healthy = False
+            if failed or unreachable:
+                endpoint.failures += 1
+            else:
+                endpoint.served += 1
+
+    def send(self, model, request):
+        """Call request(url) on the best endpoint, failing over to the others when a server stops answering."""
+        tried = []
+        while True:
+            try:
+                endpoint = self.acquire(model, exclude=tried)
+            except EndpointsUnavailable:
+                if tried:
+                    raise EndpointsUnavailable(f"every endpoint serving {model} failed: {', '.join(tried)}")
+                raise
+            try:
+                data = request(endpoint.url)
+            except FAILOVER_ERRORS as error:
+                if isinstance(error, requests.Timeout) and not isinstance(error, requests.ConnectionError):
+                    # A reply that took too long came from a server that is up, just busy or slow.
+                    self.release(endpoint, failed=True)
+                    raise
+                self.release(endpoint, unreachable=True)
+                tried.append(endpoint.url)
+                continue
+            except Exception:
+                self.release(endpoint, failed=True)
+                raise
+            self.release(endpoint)
+            data["endpoint"] = endpoint.url
+            return data
+
+    def stats(self):
+        with self._lock:
+            return [{"url": e.url, "healthy": e.healthy, "served": e.served, "failures": e.failures}
+                    for e in self.endpoints]
@@ -0,0 +1,182 @@
+import re
+from dataclasses import dataclass, field
+
+FINAL_CHUNK_NAME = "final_select"
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+
+@dataclass
+class SqlChunk:
+    name: str
+    text: str
+    start_line: int
+    end_line: int
+    depends_on: list = field(default_factory=list)
+    preamble_line: int = None
+
+
+def split_ctes(sql):
+    """Split a `with ... select` statement into one chunk per CTE plus the final query.
+
+    Chunks keep the original text and 1-based line numbers. SQL without a top-level
+    `with` clause, or that cannot be parsed, comes back as a single chunk.
+    """
+    masked = mask_comments_and_strings(sql)
+    with_match = _find_top_level_with(masked)
+    if with_match is None:
+        return [_whole(sql)]
+
+    chunks = []
+    position = with_match
+    while True:
+        parsed = _parse_cte(masked, position)
+        if parsed is None:
+            return [_whole(sql)]
+        name, start, end = parsed
+        chunks.append(_chunk(sql, name, start, end))
+        position = _skip_space(masked, end)
+        if position < len(masked) and masked[position] == ",":
+            position += 1
+            continue
+        break
+
+    # Anything before `with` (usually header comments) travels with the final query.
+    preamble = sql[:with_match - len("with")]
+    final_text = sql[position:]
+    if final_text.strip():
+        final = _chunk(sql, FINAL_CHUNK_NAME, position, len(sql))
+        if preamble.strip():
+            final.text = preamble.strip("\n") + "\n...\n" + final.text
+            final.preamble_line = _line_of(sql, len(preamble) - len(preamble.lstrip("\n")))
+        chunks.append(final)
+
+    names = [chunk.name for chunk in chunks if chunk.name != FINAL_CHUNK_NAME]
+    for chunk in chunks:
+        chunk.depends_on = referenced_names(mask_comments_and_strings(chunk.text), names, exclude=chunk.name)
+    return chunks
+
+
+def chunk_line_numbers(chunk):
+    """The original line of each line in chunk.text; the `...` joining a preamble to the final query has none."""
+    count = chunk.text.count("\n") + 1
+    body = range(chunk.start_line, chunk.end_line + 1)
+    if chunk.preamble_line is None:
+        return list(range(chunk.start_line, chunk.start_line + count))
+    preamble = count - len(body) - 1
+    return list(range(chunk.preamble_line, chunk.preamble_line + preamble)) + [None] + list(body)
+
+
+def referenced_names(masked_text, names, exclude=None):
+    words = {word.lower() for word in _WORD.findall(masked_text)}
+    return [name for name in names if name.lower() in words and name != exclude]
+
+
+def mask_comments_and_strings(sql):
+    """Blank out comments and literals so keyword and bracket scanning ignores them; offsets and newlines are kept."""
+    out = []
+    i = 0
+    length = len(sql)
+    while i < length:
+        two = sql[i:i + 2]
+        if two == "--":
+            end = sql.find("\n", i)
+            end = length if end == -1 else end
+            out.append(" " * (end - i))
+            i = end
+        elif two == "/*":
+            end = sql.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            out.append(_blank(sql[i:end]))
+            i = end
+        elif sql[i] in "'\"":
+            quote = sql[i]
+            end = i + 1
+            while end < length:
+                if sql[end] == quote:
+                    if sql[end + 1:end + 2] == quote:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            end = min(end + 1, length)
+            out.append(_blank(sql[i:end]))
+            i = end
+        else:
+            out.append(sql[i])
+            i += 1
+    return "".join(out)
+
+
+def _blank(text):
+    return re.sub(r"[^\n]", " ", text)
+
+
+def _find_top_level_with(masked):
+    depth = 0
+    for match in re.finditer(r"[()]|\bwith\b", masked, re.IGNORECASE):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return match.end()
+    return None
+
+
+def _parse_cte(masked, position):
+    position = _skip_space(masked, position)
+    recursive = re.match(r"recursive\b", masked[position:], re.IGNORECASE)
+    if recursive:
+        position = _skip_space(masked, position + recursive.end())
+    start = position
+    name = _WORD.match(masked, position)
+    if not name:
+        return None
+    position = _skip_space(masked, name.end())
+    if masked[position:position + 1] == "(":
+        columns_end = _matching_paren(masked, position)
+        if columns_end is None:
+            return None
+        position = _skip_space(masked, columns_end)
+    keyword = re.match(r"as\b\s*((not\s+)?materialized\b\s*)?", masked[position:], re.IGNORECASE)
+    if not keyword:
+        return None
+    position = _skip_space(masked, position + keyword.end())
+    if masked[position:position + 1] != "(":
+        return None
+    end = _matching_paren(masked, position)
+    if end is None:
+        return None
+    return name.group(0), start, end
+
+
+def _matching_paren(masked, position):
+    depth = 0
+    for index in range(position, len(masked)):
+        if masked[index] == "(":
+            depth += 1
+        elif masked[index] == ")":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+
+def _skip_space(masked, position):
+    while position < len(masked) and masked[position].isspace():
+        position += 1
+    return position
+
+
+def _line_of(sql, offset):
+    return sql.count("\n", 0, offset) + 1
+
+
+def _chunk(sql, name, start, end):
+    return SqlChunk(name=name, text=sql[start:end], start_line=_line_of(sql, start), end_line=_line_of(sql, end))
+
+
+def _whole(sql):
+    return SqlChunk(name=FINAL_CHUNK_NAME, text=sql, start_line=1, end_line=_line_of(sql, len(sql)))
@@ -0,0 +1,163 @@
+import re
+from dataclasses import dataclass
+
+KEYWORD_CASE = "keyword-case"
+OBJECT_NAME_CASE = "object-name-case"
+PREFER_CTE = "prefer-cte"
+POSTGRES_COMPAT = "postgres-compat"
+
+KEYWORDS = {
+    "all", "and", "any", "as", "asc", "between", "by", "case", "cross", "desc", "distinct", "else", "end", "except",
+    "exists", "false", "fetch", "filter", "first", "following", "from", "full", "group", "having", "ilike", "in",
+    "inner", "intersect", "interval", "is", "join", "lateral", "last", "left", "like", "limit", "materialized", "not",
+    "null", "nulls", "offset", "on", "or", "order", "outer", "over", "partition", "preceding", "qualify", "range",
+    "recursive", "right", "rows", "select", "then", "true", "unbounded", "union", "using", "when", "where", "window",
+    "with", "insert", "into", "values", "update", "set", "delete", "create", "replace", "table", "view", "temporary",
+    "drop", "alter", "merge", "matched",
+}
+# Functions and keywords that PostgreSQL does not have, with what to use instead.
+POSTGRES_REPLACEMENTS = {
+    "ifnull": "coalesce()",
+    "nvl": "coalesce()",
+    "isnull": "coalesce()",
+    "iff": "case when ... end",
+    "dateadd": "date + interval arithmetic",
+    "datediff": "date subtraction or age()",
+    "getdate": "now()",
+    "len": "length()",
+    "to_varchar": "to_char() or ::text",
+    "qualify": "a window function in a CTE filtered by where",
+}
+
+_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<punct>.)
+""", re.VERBOSE | re.DOTALL)
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    line: int
+
+
+@dataclass
+class LintFinding:
+    rule: str
+    line: int
+    token: str
+    message: str
+
+
+def scan(sql):
+    """Every token, whitespace and comments included, with the 1-based line it starts on."""
+    line = 1
+    for match in _TOKEN.finditer(sql):
+        yield Token(match.lastgroup, match.group(), line)
+        line += match.group().count("\n")
+
+
+def tokenize(sql):
+    """Significant tokens (no whitespace or comments) with their 1-based line numbers."""
+    return [token for token in scan(sql) if token.kind not in ("space", "comment")]
+
+
+def lint_sql(sql):
+    """Check the mechanical planning rules: keyword case, object-name case, CTEs over subqueries, PostgreSQL syntax."""
+    tokens = tokenize(sql)
+    qualifiers = {tokens[i].text.lower() for i in range(len(tokens) - 1)
+                  if tokens[i].kind == "word" and tokens[i + 1].text == "."}
+    findings = []
+    cast_depths = []
+    depth = 0
+
+    def add(rule, token, message):
+        findings.append(LintFinding(rule, token.line, token.text, message))
+
+    for index, token in enumerate(tokens):
+        previous = tokens[index - 1] if index else None
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+
+        if token.text == "(":
+            depth += 1
+            nested = tokens[index + 1] if index + 1 < len(tokens) else None
+            opener = previous.text.lower() if previous else ""
+            if nested and nested.text.lower() == "select" and opener not in ("as", "materialized"):
+                add(PREFER_CTE, nested, "subquery; move it into a named CTE")
+            continue
+        if token.text == ")":
+            if cast_depths and cast_depths[-1] == depth:
+                cast_depths.pop()
+            depth -= 1
+            continue
+        if token.kind != "word":
+            continue
+
+        word = token.text.lower()
+        qualified = (previous is not None and previous.text == ".") or (following is not None and following.text == ".")
+        call = following is not None and following.text == "("
+        after_as = previous is not None and previous.text.lower() == "as"
+        in_cast_type = after_as and bool(cast_depths) and cast_depths[-1] == depth
+
+        if word == "cast" and call:
+            cast_depths.append(depth + 1)
+        if (call or word == "qualify") and word in POSTGRES_REPLACEMENTS:
+            add(POSTGRES_COMPAT, token, f"`{token.text}` is not PostgreSQL; use {POSTGRES_REPLACEMENTS[word]}")
+        if in_cast_type and word == "string":
+            add(POSTGRES_COMPAT, token, "`STRING` is not a PostgreSQL type; use text")
+        if word in ("from", "join") and _three_part_name(tokens, index + 1):
+            add(POSTGRES_COMPAT, tokens[index + 1], "cross-database reference; PostgreSQL only resolves schema.table")
+
+        if in_cast_type or call or (word in KEYWORDS and not qualified and not after_as):
+            if token.text != word:
+                add(KEYWORD_CASE, token, f"`{token.text}` should be `{word}`")
+        elif word not in qualifiers and token.text != token.text.upper():
+            add(OBJECT_NAME_CASE, token, f"`{token.text}` should be `{token.text.upper()}`")
+    return findings
+
+
+def _three_part_name(tokens, index):
+    parts = tokens[index:index + 5]
+    return (len(parts) == 5 and parts[1].text == "." and parts[3].text == "."
+            and all(part.kind in ("word", "quoted") for part in parts[::2]))
+
+
+def group_findings(findings):
+    """{rule: {message: [lines]}} in first-seen order, so repeated violations collapse to one entry."""
+    grouped = {}
+    for finding in findings:
+        grouped.setdefault(finding.rule, {}).setdefault(finding.message, []).append(finding.line)
+    return grouped
+
+
+def lint_summary(findings, examples=6):
+    """A short plain-text digest for the LLM prompt."""
+    if not findings:
+        return "The linter found no keyword-case, object-name-case, subquery or PostgreSQL syntax issues."
+    lines = [f"The linter already reported {len(findings)} issues to the user; do not repeat them:"]
+    for rule, messages in group_findings(findings).items():
+        shown = [f"{message} (line {', '.join(map(str, sorted(set(lines_))[:3]))})"
+                 for message, lines_ in list(messages.items())[:examples]]
+        more = f" and {len(messages) - examples} more" if len(messages) > examples else ""
+        lines.append(f"- {rule}: " + "; ".join(shown) + more)
+    return "\n".join(lines)
+
+
+def lint_markdown(findings):
+    if not findings:
+        return "## Lint\n\nNo mechanical rule violations found.\n"
+    rows = ["## Lint", "", "| Rule | Issue | Lines |", "|------|-------|-------|"]
+    for rule, messages in group_findings(findings).items():
+        for message, lines in messages.items():
+            rows.append(f"| {rule} | {message} | {', '.join(map(str, sorted(set(lines))))} |")
+    return "\n".join(rows) + "\n"
+
+
+def findings_between(findings, start_line, end_line):
+    return [finding for finding in findings if start_line <= finding.line <= end_line]
@@ -0,0 +1,98 @@
+import json
+
+from ollama_client import strip_reasoning
+
+SEVERITIES = ("HIGH", "MEDIUM", "LOW")
+REVIEW_PILLARS = ("correctness", "performance", "portability", "readability", "security")
+
+
+def findings_schema(pillars=REVIEW_PILLARS, extra=None):
+    """JSON schema for Ollama's format parameter: {"findings": [{severity, rule, location, recommendation, pillar}]}.
+
+    extra adds properties (name: schema) to each finding. Without pillars any pillar name is accepted.
+    """
+    properties = {
+        "severity": {"type": "string", "enum": list(SEVERITIES)},
+        "rule": {"type": "string"},
+        "location": {"type": "string"},
+        "recommendation": {"type": "string"},
+        "pillar": {"type": "string", "enum": list(pillars)} if pillars else {"type": "string"},
+        **(extra or {}),
+    }
+    return {
+        "type": "object",
+        "properties": {
+            "findings": {
+                "type": "array",
+                "items": {"type": "object", "properties": properties, "required": list(properties)},
+            },
+        },
+        "required": ["findings"],
+    }
+
+
+FINDINGS_SCHEMA = findings_schema()
+
+
+def format_rules(schema):
+    """Format rules for a structured reply; Ollama constrains the output, but the model still needs the meaning."""
+    return ("Return only JSON matching this schema, one entry per finding and an empty list when there is nothing "
+            "to report. rule names the problem in a few words, location is file:line using the line numbers shown "
+            "and recommendation is one sentence.\n" + json.dumps(schema, separators=(",", ":")))
+
+
+def parse_structured(content, schema):
+    """(valid findings, problems) from a structured reply; invalid findings are dropped and described in problems."""
+    try:
+        document = json.loads(strip_reasoning(content))
+    except ValueError as error:
+        return [], [f"reply is not JSON: {error}"]
+    items = document.get("findings") if isinstance(document, dict) else None
+    if not isinstance(items, list):
+        return [], ["reply has no findings list"]
+    properties = schema["properties"]["findings"]["items"]["properties"]
+    findings = []
+    problems = []
+    for index, item in enumerate(items):
+        finding, problem = validate_finding(item, properties)
+        if problem:
+            problems.append(f"finding {index}: {problem}")
+        else:
+            findings.append(finding)
+    return findings, problems
+
+
+def validate_finding(item, properties):
+    """(finding, None) with only the schema's fields, or (None, problem). Enum values are matched case-insensitively."""
+    if not isinstance(item, dict):
+        return None, "not an object"
+    finding = {}
+    for name, rule in properties.items():
+        value = item.get(name)
+        if not isinstance(value, str) or not value.strip():
+            return None, f"{name} missing or not text"
+        value = value.strip()
+        if "enum" in rule:
+            matches = [option for option in rule["enum"] if option.lower() == value.lower()]
+            if not matches:
+                return None, f"{name} {value!r} is not one of {', '.join(rule['enum'])}"
+            value = matches[0]
+        finding[name] = value
+    return finding, None
+
+
+def findings_markdown(findings):
+    """Render findings as the markdown the model used to write, most severe first."""
+    if not findings:
+        return "## Findings\n\nNo findings.\n"
+    lines = ["## Findings", "", "| Severity | Pillar | Rule | Location | Recommendation |",
+             "|----------|--------|------|----------|----------------|"]
+    for finding in sorted(findings, key=lambda f: SEVERITIES.index(f["severity"])):
+        cells = [finding[name].replace("|", "\\|").replace("\n", " ") for name in
+                 ("severity", "pillar", "rule", "location", "recommendation")]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def severity_counts(findings):
+    return {severity: sum(finding["severity"] == severity for finding in findings) for severity in SEVERITIES}
@@ -0,0 +1,155 @@
+import datetime
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+DEFAULT_LOG_PATH = ".code-review/telemetry/calls.jsonl"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+METRIC_PREFIX = "code_review_llm"
+
+
+def call_record(model, endpoint, data=None, latency=0, queue_wait=0, chunk_id=None, error=None):
+    """One structured record per LLM call, with throughput derived from Ollama's own counters.
+
+    Cache hits keep the flag but report no Ollama work, since nothing ran on the server.
+    """
+    data = data or {}
+    cache_hit = data.get("cache_hit", False)
+    served = {} if cache_hit else data
+    eval_count = served.get("eval_count", 0)
+    eval_duration = served.get("eval_duration", 0)
+    prompt_count = served.get("prompt_eval_count", 0)
+    prompt_duration = served.get("prompt_eval_duration", 0)
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "model": model,
+        "endpoint": endpoint,
+        "chunk_id": chunk_id,
+        "status": "error" if error else "ok",
+        "error": error,
+        "cache_hit": cache_hit,
+        "retries": data.get("retries", 0),
+        "stopped": data.get("stopped"),
+        "queue_wait": queue_wait,
+        "latency": latency,
+        "time_to_first_token": data.get("time_to_first_token"),
+        "total_duration": served.get("total_duration", 0),
+        "load_duration": served.get("load_duration", 0),
+        "prompt_eval_count": prompt_count,
+        "prompt_eval_duration": prompt_duration,
+        "eval_count": eval_count,
+        "eval_duration": eval_duration,
+        "tokens_per_sec": eval_count / (eval_duration / 1e9) if eval_duration else None,
+        "prompt_tokens_per_sec": prompt_count / (prompt_duration / 1e9) if prompt_duration else None,
+    }
+
+
+class Telemetry:
+    """Appends every call record to a rotating JSONL log and keeps Prometheus-style aggregates.
+
+    Durations in records are nanoseconds, matching Ollama; the metrics use seconds.
+    """
+
+    def __init__(self, log_path=DEFAULT_LOG_PATH, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self._logger = None
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"{__name__}.{os.path.abspath(log_path)}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.handlers = [handler]
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._server = None
+
+    def record(self, record):
+        if self._logger:
+            self._logger.info(json.dumps(record))
+        labels = (("model", record["model"]),)
+        with self._lock:
+            self._add("requests_total", labels + (("status", record["status"]),))
+            if record["cache_hit"]:
+                self._add("cache_hits_total", labels)
+            self._add("retries_total", labels, record["retries"])
+            self._add("prompt_tokens_total", labels, record["prompt_eval_count"])
+            self._add("generated_tokens_total", labels, record["eval_count"])
+            self._add("load_seconds_total", labels, record["load_duration"] / 1e9)
+            self._add("prompt_eval_seconds_total", labels, record["prompt_eval_duration"] / 1e9)
+            self._add("eval_seconds_total", labels, record["eval_duration"] / 1e9)
+            self._observe("request_duration_seconds", labels, record["latency"] / 1e9)
+            self._observe("queue_wait_seconds", labels, record["queue_wait"] / 1e9)
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{METRIC_PREFIX}_{name}{_labels(labels)} {value:g}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+                for (metric, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                        lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{METRIC_PREFIX}_{name}_sum{_labels(labels)} {total:g}")
+                    lines.append(f"{METRIC_PREFIX}_{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def start_metrics_server(self, port, host="127.0.0.1"):
+        """Serve the aggregates at http://host:port/metrics from a background thread."""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._logger:
+            for handler in self._logger.handlers:
+                handler.close()
+
+    def _add(self, name, labels, amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        buckets, total, count = self._histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+        buckets = [bucket + (value <= bound) for bucket, bound in zip(buckets, DURATION_BUCKETS)]
+        self._histograms[key] = (buckets, total + value, count + 1)
+
+
+def _labels(labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
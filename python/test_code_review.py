@@ -0,0 +1,389 @@
+import os
+import subprocess
+
+import pytest
+import requests
+
+from batch_review import ReviewUnit, run_batch
+from code_index import statement_contexts
+from code_review import get_code_for_review, partial_review, reduce_reviews
+from deadline import MIN_NUM_PREDICT, DeadlineScheduler, RateProfile
+from incremental import plan_incremental, unit_sha
+from job_journal import JobJournal, resume_plan
+from near_duplicates import group_near_duplicates, member_findings
+from ollama_client import estimate_tokens
+from ollama_stub import StubOllama
+from prompt_compaction import Compaction, compact_sql
+from reasoning import END_MARKER, ReasoningStream
+from review_cache import ReviewCache, cache_key
+from review_client import ReviewClient
+from scheduler import EndpointPool
+from sql_chunker import FINAL_CHUNK_NAME, chunk_line_numbers, split_ctes
+from sql_lint import lint_sql
+
+SAMPLE = get_code_for_review()
+SAMPLE_LINES = SAMPLE.split("\n")
+
+
+def test_split_ctes_gives_each_cte_and_the_final_query_its_own_chunk():
+    chunks = split_ctes(SAMPLE)
+
+    assert [chunk.name for chunk in chunks] == [
+        "chu_recent_inhouse_big_win_plays", "chu_recent_ris_big_win_plays", "chu_winners",
+        "lls_recent_big_win_plays", "lls_winners", "pok_winners", "all_winners", "distinct_winners",
+        "player_state", "winners_final", FINAL_CHUNK_NAME,
+    ]
+    by_name = {chunk.name: chunk for chunk in chunks}
+    assert by_name["chu_winners"].depends_on == ["chu_recent_inhouse_big_win_plays", "chu_recent_ris_big_win_plays"]
+    assert by_name["all_winners"].depends_on == ["chu_winners", "lls_winners", "pok_winners"]
+    assert by_name[FINAL_CHUNK_NAME].depends_on == ["winners_final"]
+
+
+def test_split_ctes_keeps_the_original_line_numbers():
+    for chunk in split_ctes(SAMPLE):
+        if chunk.name == FINAL_CHUNK_NAME:
+            continue
+        assert SAMPLE_LINES[chunk.start_line - 1].lstrip().startswith(chunk.name)
+        assert chunk.text in "\n".join(SAMPLE_LINES[chunk.start_line - 1:chunk.end_line])
+        assert chunk.text.rstrip().endswith(")")
+
+
+def test_final_chunk_maps_its_preamble_back_to_the_header_comments():
+    final = split_ctes(SAMPLE)[-1]
+    numbers = chunk_line_numbers(final)
+    text_lines = final.text.split("\n")
+
+    assert len(numbers) == len(text_lines)
+    for number, line in zip(numbers, text_lines):
+        if number is None:
+            assert line == "..."
+        else:
+            assert SAMPLE_LINES[number - 1].endswith(line)
+    assert numbers[0] == 2 and numbers[-1] == final.end_line
+
+
+def test_each_chunk_is_sent_the_definitions_of_the_ctes_it_reads_from():
+    contexts = statement_contexts(split_ctes(SAMPLE))
+
+    assert '<definition name="all_winners" kind="cte"' in contexts["winners_final"]
+    assert '<definition name="player_state" kind="cte"' in contexts["winners_final"]
+    assert "chu_recent_inhouse_big_win_plays" not in contexts["winners_final"]
+    assert "chu_recent_inhouse_big_win_plays" not in contexts
+
+
+def test_lint_sql_reports_each_rule_on_the_line_it_applies_to():
+    sql = """-- header comment
+/* a block comment
+   over two lines */
+with recent as (
+    SELECT ifnull(a, 0) as A
+    from db.sch.tbl
+)
+select * from (select A from recent) x
+"""
+    found = {(finding.rule, finding.token, finding.line) for finding in lint_sql(sql)}
+
+    assert ("keyword-case", "SELECT", 5) in found
+    assert ("postgres-compat", "ifnull", 5) in found
+    assert ("postgres-compat", "db", 6) in found
+    assert ("object-name-case", "tbl", 6) in found
+    assert ("object-name-case", "recent", 4) in found
+    assert ("prefer-cte", "select", 8) in found
+    assert not any(finding.token in ("sch", "A") for finding in lint_sql(sql))
+
+
+def test_compact_sql_prefixes_each_line_with_its_original_line_number():
+    sql = """select
+    cast(
+        user_id AS STRING)   as   USER_ID,
+    'a   b' as S -- keep me
+from T
+"""
+    assert compact_sql(sql).text.split("\n") == [
+        "1|select",
+        "2|cast(user_id AS STRING) as USER_ID,",
+        "4|'a   b' as S -- keep me",
+        "5|from T",
+    ]
+    assert compact_sql(sql, [10, 11, 12, 13, 14, 15]).text.split("\n")[1].startswith("11|cast(")
+
+
+def test_compacting_the_sample_keeps_line_numbers_and_saves_tokens():
+    compaction = Compaction()
+    text = compaction.apply(SAMPLE).text
+
+    for line in text.split("\n"):
+        number, _, code = line.partition("|")
+        assert SAMPLE_LINES[int(number) - 1].strip()[:1] == code[:1]
+    assert compaction.tokens < compaction.original_tokens
+
+
+def _window_unit(unit_id, first, last):
+    text = " ".join(f"w{number}" for number in range(first, last))
+    return ReviewUnit(unit_id, f"{unit_id}.py", unit_id, text, 1, 1)
+
+
+def test_near_duplicates_are_only_grouped_with_a_similar_representative():
+    # a~b and b~c at 0.73, but a and c only share 0.53 of their shingles.
+    units = [_window_unit("a", 0, 100), _window_unit("b", 15, 115), _window_unit("c", 30, 130)]
+
+    assert group_near_duplicates(units, threshold=0.6) == {"b": ("a", 0.73)}
+    assert group_near_duplicates(units, threshold=0.5) == {"b": ("a", 0.73), "c": ("a", 0.53)}
+
+
+def test_copied_findings_cite_the_members_own_lines():
+    representative = ReviewUnit("a.sql#x", "a.sql", "x", "", 10, 25)
+    member = ReviewUnit("a.sql#y", "a.sql", "y", "", 26, 40)
+    findings = [{"severity": "LOW", "location": "a.sql:18"}, {"severity": "LOW", "location": "lines 12-14"},
+                {"severity": "LOW", "location": "line 99"}]
+
+    copied = member_findings(findings, representative, member)
+
+    assert [finding["location"] for finding in copied] == ["a.sql:34", "lines 28-30", "line 99"]
+    assert all(finding["duplicate_of"] == "a.sql#x" for finding in copied)
+
+
+def test_reasoning_stream_counts_reasoning_apart_from_the_answer():
+    stream = ReasoningStream()
+    for token in ["<th", "ink>", "\nweighing ", "it up", "</think>", "\n\n", "## Findings", "\n"]:
+        assert stream.feed(token) is None
+
+    assert stream.counts() == {"reasoning_tokens": 5, "answer_tokens": 3}
+
+
+def test_reasoning_stream_does_not_count_leading_whitespace_or_the_answer_after_it_as_reasoning():
+    stream = ReasoningStream()
+    for token in ["\n", " ", "## Findings", "\n"]:
+        stream.feed(token)
+    assert stream.counts() == {"reasoning_tokens": 0, "answer_tokens": 4}
+
+    stream = ReasoningStream()
+    for token in ["\n", "<think>", "a", "</th", "ink>", "ok"]:
+        stream.feed(token)
+    assert stream.counts() == {"reasoning_tokens": 4, "answer_tokens": 2}
+    assert stream.text == "\n<think>a</think>ok"
+
+
+def test_reasoning_stream_stops_when_the_budget_runs_out_and_steers_to_the_answer():
+    stream = ReasoningStream(budget=3)
+
+    assert stream.feed("<think>") is None
+    assert stream.feed("one ") is None
+    assert stream.feed("two ") == "reasoning_budget"
+    stream.steer("\n</think>\n\n")
+    assert stream.feed("## Findings") is None
+    assert stream.counts() == {"reasoning_tokens": 3, "answer_tokens": 1}
+
+
+def _review(**settings):
+    server = StubOllama(time_scale=0).start()
+    try:
+        messages = [{"role": "user", "content": f"Review this. Finish the review with a line reading {END_MARKER}."}]
+        return ReviewClient(server.url, **settings).send(messages)
+    finally:
+        server.stop()
+
+
+def test_early_stop_ends_the_reply_at_the_marker_with_ollamas_own_counters():
+    data = _review(early_stop=True)
+
+    assert END_MARKER not in data["message"]["content"]
+    assert "afterthought" not in data["message"]["content"]
+    assert data["done_reason"] == "stop" and data["stopped"] is None
+    assert data["load_duration"] > 0
+
+
+def test_early_stop_inside_the_reasoning_is_steered_to_an_answer():
+    data = _review(early_stop=True, options={"stop": ["step 3 "]})
+
+    assert data["steered"]
+    assert "## Findings" in data["message"]["content"]
+    assert data["answer_tokens"] > 0
+
+
+def test_reasoning_budget_stop_returns_the_reasoning_so_far():
+    data = _review(reasoning_budget=5, on_budget="stop")
+
+    assert data["stopped"] == "reasoning_budget"
+    assert data["reasoning_tokens"] == 5 and data["answer_tokens"] == 0
+
+
+def test_batch_retries_with_backoff_when_no_endpoint_of_a_pool_is_available(tmp_path):
+    urls = ["http://127.0.0.1:1/api/chat", "http://127.0.0.1:2/api/chat"]
+    client = ReviewClient(urls[0], pool=EndpointPool(urls))
+    unit = ReviewUnit("b.py", "b.py", "b.py", "print('hi')", 1, 1)
+
+    results = run_batch([unit], str(tmp_path), client, attempts=3, backoff=0)
+
+    assert results["b.py"]["status"] == "error"
+    assert results["b.py"]["attempts"] == 3
+
+
+def test_reduce_merges_in_rounds_when_the_partial_reviews_do_not_fit_one_request():
+    server = StubOllama(time_scale=0).start()
+    try:
+        client = ReviewClient(server.url, num_ctx=2048, reply_tokens=512)
+        sent = []
+        send = client.send
+        client.send = lambda messages, **kwargs: sent.append(messages) or send(messages, **kwargs)
+        reviews = [partial_review(f"cte_{n}", n * 10 + 1, n * 10 + 9, "deepseek-r1:14b", f"finding {n} " * 200)
+                   for n in range(12)]
+
+        data = reduce_reviews(client, reviews)
+    finally:
+        server.stop()
+
+    assert data["reduce_rounds"] >= 1 and len(sent) > 1
+    for messages in sent:
+        assert sum(estimate_tokens(message["content"]) for message in messages) <= client.prompt_budget()
+    assert 'part="cte_0 to cte_' in sent[-1][1]["content"]
+
+
+def test_cache_evicts_the_least_recently_used_entries_once_it_grows_past_max_bytes(tmp_path, monkeypatch):
+    cache = ReviewCache(str(tmp_path), max_bytes=1000)
+    reply = {"message": {"content": "x" * 300}}
+    for n in range(3):
+        cache.put({"n": n}, reply)
+        os.utime(cache._path(cache_key({"n": n})), (1000 + n, 1000 + n))
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+    cache.get({"n": 0})
+
+    cache.put({"n": 1}, reply)
+    assert not scans and cache.stats()["evictions"] == 0
+
+    cache.put({"n": 3}, reply)
+    assert len(scans) == 1
+    assert cache.get({"n": 2}) is None
+    assert cache.get({"n": 0}) is not None and cache.get({"n": 3}) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_pool_fails_over_from_a_dead_endpoint_and_rechecks_when_all_look_down():
+    server = StubOllama(time_scale=0).start()
+    dead = "http://127.0.0.1:1/api/chat"
+    try:
+        pool = EndpointPool([dead, server.url])
+        client = ReviewClient(dead, pool=pool)
+        messages = [{"role": "user", "content": "Review this."}]
+
+        assert client.send(messages)["endpoint"] == server.url
+        assert [endpoint.healthy for endpoint in pool.endpoints] == [False, True]
+
+        pool.endpoints[1].healthy = False
+        assert client.send(messages + [{"role": "user", "content": "Again."}])["endpoint"] == server.url
+        assert pool.endpoints[1].healthy
+    finally:
+        server.stop()
+
+
+def test_pool_keeps_an_endpoint_whose_reply_timed_out_in_rotation():
+    server = StubOllama(time_scale=0).start()
+    try:
+        pool = EndpointPool([server.url])
+
+        def slow(url):
+            raise requests.ReadTimeout("read timed out")
+
+        with pytest.raises(requests.ReadTimeout):
+            pool.send("deepseek-r1:14b", slow)
+        assert pool.stats() == [{"url": server.url, "healthy": True, "served": 0, "failures": 1}]
+    finally:
+        server.stop()
+
+
+def test_resume_plan_only_skips_units_finished_unchanged_with_their_report_on_disk(tmp_path):
+    units = [ReviewUnit(name, f"{name}.sql", name, f"select {name}", 1, 1) for name in ("a", "b", "c", "d")]
+    journal = JobJournal(str(tmp_path / "journal.jsonl"))
+    for unit in units[:3]:
+        journal.record(unit.id, {"status": "in_flight", "attempt": 1})
+        journal.record(unit.id, {"status": "done", "sha": unit_sha(unit), "result_file": f"{unit.id}.md",
+                                 "attempt": 1})
+    journal.record("d", {"status": "in_flight", "attempt": 1})
+    with open(journal.path, "a", encoding="utf-8") as file:
+        file.write('{"id": "d", "status": "do')
+    (tmp_path / "a.md").write_text("a")
+    (tmp_path / "b.md").write_text("b")
+    units[1].text = "select b2"
+
+    to_review, finished = resume_plan(units, journal, str(tmp_path))
+
+    assert [unit.id for unit in to_review] == ["b", "c", "d"]
+    assert finished == {"a": {"status": "done", "result_file": "a.md"}}
+
+
+def _git(base, *args):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   cwd=base, check=True, capture_output=True)
+
+
+def test_incremental_plan_reviews_units_overlapping_a_changed_hunk_and_carries_the_rest(tmp_path):
+    lines = [f"line {number}" for number in range(1, 31)]
+    (tmp_path / "a.sql").write_text("\n".join(lines) + "\n")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", "a.sql")
+    _git(tmp_path, "commit", "-q", "-m", "first")
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=tmp_path, capture_output=True, text=True).stdout.strip()
+    lines[14] = "line 15 changed"
+    (tmp_path / "a.sql").write_text("\n".join(lines) + "\n")
+    # The units keep their reviewed text so only the diff decides; a fourth unit is new since that batch.
+    units = [ReviewUnit(f"a.sql#{first}", "a.sql", str(first), f"unit {first}", first, first + 9)
+             for first in (1, 11, 21)]
+    units.append(ReviewUnit("b.sql", "b.sql", "b.sql", "select 1", 1, 1))
+    previous = {"name": "last", "commit": commit, "units": [
+        {"id": unit.id, "status": "done", "sha": unit_sha(unit), "result_file": f"{unit.name}.md"}
+        for unit in units[:3]]}
+
+    to_review, carried = plan_incremental(units, str(tmp_path), previous)
+
+    assert [unit.id for unit in to_review] == ["a.sql#11", "b.sql"]
+    assert carried == {"a.sql#1": {"status": "done", "result_file": "1.md", "carried_from": "last"},
+                       "a.sql#21": {"status": "done", "result_file": "21.md", "carried_from": "last"}}
+
+
+def _scheduler(deadline, fallback_models=("small",)):
+    profile = RateProfile()
+    # "big" writes 10 tokens/s and "small" 100, both reading prompts at 1000 tokens/s and replying in 1000 tokens.
+    for model, eval_seconds in (("big", 100), ("small", 10)):
+        profile.observe("http://box", model, {"eval_count": 1000, "eval_duration": eval_seconds * 1e9,
+                                              "prompt_eval_count": 1000, "prompt_eval_duration": 1e9})
+    units = [ReviewUnit(name, f"{name}.sql", name, "", 1, 1) for name in ("a", "b")]
+    scheduler = DeadlineScheduler(profile, deadline, workers=1, model="big", fallback_models=fallback_models)
+    scheduler.queue(units, {unit.id: [{"role": "user", "content": "x" * 1400}] for unit in units})
+    return scheduler
+
+
+def test_deadline_scheduler_leaves_units_alone_when_the_batch_fits():
+    scheduler = _scheduler(deadline=1000)
+
+    for _ in range(2):
+        _, assignment = scheduler.take()
+        assert (assignment.model, assignment.num_predict, assignment.downgrades) == ("big", None, [])
+    assert scheduler.downgraded == {}
+
+
+def test_deadline_scheduler_caps_the_reply_before_switching_models():
+    # Each unit needs ~100s on "big"; 180s leaves one of two units ~80s, enough for a capped reply.
+    _, assignment = _scheduler(deadline=180).take()
+
+    assert assignment.model == "big"
+    assert MIN_NUM_PREDICT <= assignment.num_predict < 1000
+    assert assignment.downgrades == [f"num_predict {assignment.num_predict}"]
+
+
+def test_deadline_scheduler_switches_model_and_keeps_later_units_on_it():
+    scheduler = _scheduler(deadline=100)
+
+    first, assignment = scheduler.take()
+    assert (assignment.model, assignment.num_predict) == ("small", None)
+    assert scheduler.downgraded[first.id] == ["model big -> small"]
+    _, assignment = scheduler.take()
+    assert assignment.model == "small"
+
+
+def test_deadline_scheduler_flags_a_deadline_it_cannot_meet():
+    _, assignment = _scheduler(deadline=10, fallback_models=()).take()
+
+    assert (assignment.model, assignment.num_predict) == ("big", MIN_NUM_PREDICT)
+    assert assignment.downgrades[-1] == "deadline at risk"